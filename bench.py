@@ -0,0 +1,321 @@
+"""
+    Benchmarks for custom_tokenizer, run with
+
+        python bench.py -o bench_output.txt
+        python bench.py --compare old_bench_output.txt
+
+    Covers PreTokenizer.tokenize end to end, every TokenizeRule on its own and wrapped_nltk_sentence_split
+    with and without use_quote and use_dialogue. The corpora are generated from a fixed seed so every run
+    and every version of the tokenizer sees the same text. Results are written as JSON, one object per case
+    with docs/s, tokens/s and the peak memory traced while running the case once.
+    Needs nothing but the standard library, the sentence splitting cases are skipped when the punkt model is not installed.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import custom_tokenizer
+
+
+NAMES = ["John", "Mary", "Dr. Smith", "Mr. Brown", "Anna", "the U.S. Senate", "NASA", "the BBC", "Prof. Lee", "Jr. Adams"]
+VERBS = ["said", "wrote", "asked", "shouted", "claimed", "noted", "replied", "whispered"]
+NOUNS = ["report", "budget", "meeting", "car", "house", "letter", "plan", "market", "song", "e-mail"]
+ACRONYMS = ["U.S.", "U.K.", "E.U.", "NATO", "UNESCO", "FBI", "I.B.M.", "a.m.", "p.m.", "e.g.", "i.e.", "etc."]
+CONTRACTIONS = ["don't", "can't", "won't", "it's", "I'm", "you're", "they've", "we'd", "isn't", "wouldn't", "y'all", "o'clock"]
+DOMAINS = ["example.com", "www.gavagai.se", "docs.python.org/3/library", "en.wikipedia.org/wiki/Tokenization"]
+
+
+def _sentence(rng):
+    return "{} {} that the {} was {}.".format(rng.choice(NAMES), rng.choice(VERBS), rng.choice(NOUNS),
+                                           rng.choice(["late", "fine", "over budget", "NOT READY", "great"]))
+
+def _quotes(rng):
+    quote = _sentence(rng).rstrip(".") + rng.choice([".", "!", "?"])
+    return rng.choice([
+        '"{}" {} {}. '.format(quote, rng.choice(VERBS), rng.choice(NAMES)),
+        "{} {}: \"{}\" Then it {}. ".format(rng.choice(NAMES), rng.choice(VERBS), quote, rng.choice(["ended", "stopped"])),
+        "'{}' was the answer. ".format(quote),
+        "He called it a 'quick {}' and the '{}s' agreed. ".format(rng.choice(NOUNS), rng.choice(NOUNS)),
+        "“{}” she {}. ‘Fine,’ he said. ".format(quote, rng.choice(VERBS)),
+        "- {} - {} ".format(quote, _sentence(rng)),
+    ])
+
+def _numbers(rng):
+    return rng.choice([
+        "It costs ${:,}.{:02d} or {} EUR in {}. ".format(rng.randint(1, 99999), rng.randint(0, 99), rng.randint(1, 500), rng.randint(1900, 2030)),
+        "The meeting is at {}:{:02d} on {}/{}/{}. ".format(rng.randint(1, 12), rng.randint(0, 59), rng.randint(1, 12), rng.randint(1, 28), rng.randint(1990, 2030)),
+        "Growth was {}.{}% and {} of {} votes were counted. ".format(rng.randint(0, 40), rng.randint(0, 9), rng.randint(1, 9999), rng.randint(10000, 99999)),
+        "Call +46 {} {} {} or read section {}.{}.{}. ".format(rng.randint(10, 99), rng.randint(100, 999), rng.randint(1000, 9999), rng.randint(1, 9), rng.randint(1, 9), rng.randint(1, 9)),
+        "Between {}-{} people came, about {}k in total. ".format(rng.randint(10, 99), rng.randint(100, 999), rng.randint(1, 99)),
+    ])
+
+def _acronyms(rng):
+    return "{} met the {} at 9 {} ({}), {} with {} and {}. ".format(
+        rng.choice(NAMES), rng.choice(ACRONYMS), rng.choice(["a.m.", "p.m."]), rng.choice(ACRONYMS),
+        rng.choice(["e.g.", "i.e."]), rng.choice(ACRONYMS), rng.choice(ACRONYMS))
+
+def _urls(rng):
+    return rng.choice([
+        "Read more at http://{}/{}.html today. ".format(rng.choice(DOMAINS), rng.choice(NOUNS)),
+        "See https://{}?id={}&q={} (mirror: www.{}.org). ".format(rng.choice(DOMAINS), rng.randint(1, 999), rng.choice(NOUNS), rng.choice(NOUNS)),
+        "Mail info@{} or visit {}/about. ".format(rng.choice(DOMAINS).split("/")[0], rng.choice(DOMAINS)),
+    ])
+
+def _contractions(rng):
+    words = rng.sample(CONTRACTIONS, 3)
+    return "I {} know, {} {} say it {} be the {}'s fault. ".format(
+        words[0], words[1], rng.choice(NAMES), words[2], rng.choice(NOUNS))
+
+def _dialogue(rng):
+    return "\n- {}\n- {} \"{}\" ".format(_sentence(rng), rng.choice(["No.", "Yes!", "Why?"]), _sentence(rng))
+
+GENERATORS = {'quotes': _quotes,
+              'numbers': _numbers,
+              'acronyms': _acronyms,
+              'urls': _urls,
+              'contractions': _contractions,
+              'dialogue': _dialogue,}
+
+def make_corpus(kind, n_docs, seed=0, sentences=(2, 6)):
+    """
+        n_docs documents of a few sentences each, mixing plain sentences with ones from the generator of kind,
+        kind 'mixed' draws from all generators
+    """
+    rng = random.Random("{}:{}".format(kind, seed))
+    generators = list(GENERATORS.values()) if kind == 'mixed' else [GENERATORS[kind]]
+    docs = []
+    for _ in range(n_docs):
+        parts = []
+        for _ in range(rng.randint(*sentences)):
+            parts.append(rng.choice(generators)(rng) if rng.random() < 0.7 else _sentence(rng) + " ")
+        docs.append("".join(parts).strip())
+    return docs
+
+def make_corpora(n_docs, seed=0):
+    return {kind: make_corpus(kind, n_docs, seed) for kind in list(GENERATORS) + ['mixed']}
+
+
+def _measure(function, items, count_tokens, repeat, memory):
+    """
+        Run function on every item, repeat times, and return the best time, the number of tokens and the peak memory
+    """
+    best = None
+    tokens = 0
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        tokens = 0
+        for item in items:
+            tokens += count_tokens(function(item))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        for item in items:
+            function(item)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, tokens, peak
+
+def _result(name, group, items, seconds, tokens, peak):
+    seconds = max(seconds, 1e-9)
+    return {'name': name,
+            'group': group,
+            'docs': len(items),
+            'tokens': tokens,
+            'seconds': seconds,
+            'docs_per_sec': len(items) / seconds,
+            'tokens_per_sec': tokens / seconds,
+            'peak_memory_bytes': peak,}
+
+def _words(value):
+    return value.count(" ") + 1 if isinstance(value, str) else len(value)
+
+
+def _selected(name, pattern):
+    return not pattern or pattern in name
+
+def bench_tokenize(corpora, repeat, memory, pattern=None):
+    for kind, docs in corpora.items():
+        if not _selected("tokenize/" + kind, pattern):
+            continue
+        pretokenizer = custom_tokenizer.make_new_pretokenizer()
+        pretokenizer.compile()
+        seconds, tokens, peak = _measure(pretokenizer.tokenize, docs, lambda result: len(result.tokens), repeat, memory)
+        yield _result("tokenize/" + kind, "tokenize", docs, seconds, tokens, peak)
+
+def _all_rule_classes():
+    classes = []
+    pending = [custom_tokenizer.TokenizeRule]
+    while pending:
+        for cls in pending.pop().__subclasses__():
+            if cls not in classes:
+                classes.append(cls)
+                pending.append(cls)
+    return sorted(classes, key=lambda cls: (cls._order, cls.__name__))
+
+def rule_inputs(docs):
+    """
+        The text every rule of make_new_pretokenizer gets for each document, by rule class,
+        so the rules are measured on what they see in the pipeline instead of on raw text
+    """
+    pipeline = custom_tokenizer.make_new_pretokenizer().compile()
+    inputs = {type(rule): [] for rule in pipeline.rules}
+    for doc in docs:
+        f_holder = custom_tokenizer.FeatureHolder()
+        f_holder.set_raw_string(doc)
+        value = doc
+        for rule, (takes_tokens, use) in zip(pipeline.rules, pipeline._rule_steps):
+            if not isinstance(value, str):
+                value = " ".join(value)
+            inputs[type(rule)].append(value)
+            if takes_tokens:
+                value = value.split(" ")
+            f_holder, value = use(f_holder, value)
+    return pipeline.rules, inputs
+
+def bench_rules(docs, repeat, memory, pattern=None):
+    classes = [cls for cls in _all_rule_classes() if _selected("rule/" + cls.__name__, pattern)]
+    if not classes:
+        return
+    rules, inputs = rule_inputs(docs)
+    orders = [(rule._order, type(rule)) for rule in rules]
+    for cls in classes:
+        rule = cls()
+        if cls in inputs:
+            items = inputs[cls]
+        else:
+            # rules outside make_new_pretokenizer get the text of the pipeline rule that comes after them
+            later = [rule_cls for order, rule_cls in orders if order >= cls._order]
+            items = inputs[later[0]] if later else inputs[orders[-1][1]]
+        if rule._takes_tokens:
+            items = [item.split(" ") for item in items]
+            use = lambda tokens, rule=rule: rule.use_tokens(custom_tokenizer.FeatureHolder(), list(tokens))[1]
+        else:
+            use = lambda string, rule=rule: rule.use(custom_tokenizer.FeatureHolder(), string)[1]
+        seconds, tokens, peak = _measure(use, items, _words, repeat, memory)
+        yield _result("rule/" + cls.__name__, "rule", items, seconds, tokens, peak)
+
+def punkt_missing():
+    """
+        None when the punkt model loads, otherwise why it doesn't
+    """
+    try:
+        custom_tokenizer.get_punkt_splitter(preload=True)
+    except ImportError:
+        return "nltk is not installed"
+    except (LookupError, OSError):
+        return "the nltk punkt model is not installed"
+    return None
+
+def bench_split(corpora, repeat, memory, pattern=None):
+    missing = None
+    for kind in ('quotes', 'dialogue', 'mixed'):
+        docs = corpora[kind]
+        for use_quote, use_dialogue in ((False, False), (True, False), (False, True), (True, True)):
+            name = "split/{}/quote={}/dialogue={}".format(kind, int(use_quote), int(use_dialogue))
+            if not _selected(name, pattern):
+                continue
+            if missing is None:
+                missing = punkt_missing() or False
+            if missing:
+                yield {'name': name, 'group': "split", 'skipped': missing}
+                continue
+            split = lambda doc, q=use_quote, d=use_dialogue: custom_tokenizer.wrapped_nltk_sentence_split(
+                paragraph=doc, use_quote=q, use_dialogue=d)
+            seconds, tokens, peak = _measure(split, docs, lambda sentences: sum(map(_words, sentences)), repeat, memory)
+            result = _result(name, "split", docs, seconds, tokens, peak)
+            yield result
+
+
+def run(n_docs=500, repeat=3, seed=0, groups=("tokenize", "rule", "split"), pattern=None, memory=True, progress=None):
+    """
+        Run the benchmarks and return the report, a dict with the environment and one result per case
+    """
+    corpora = make_corpora(n_docs, seed)
+    cases = []
+    if "tokenize" in groups:
+        cases.append(bench_tokenize(corpora, repeat, memory, pattern))
+    if "rule" in groups:
+        cases.append(bench_rules(corpora['mixed'], repeat, memory, pattern))
+    if "split" in groups:
+        cases.append(bench_split(corpora, repeat, memory, pattern))
+    results = []
+    # keep anything printed out of the timings and the output
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for case in cases:
+            for result in case:
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'docs': n_docs,
+            'repeat': repeat,
+            'seed': seed,
+            'results': results,}
+
+def compare(report, baseline):
+    """
+        Lines with the docs/s of every case relative to the same case in baseline
+    """
+    old = {result['name']: result for result in baseline['results'] if 'skipped' not in result}
+    lines = ["{:<48} {:>12} {:>12} {:>8}".format("case", "old docs/s", "new docs/s", "ratio")]
+    for result in report['results']:
+        before = old.get(result['name'])
+        if before is None or 'skipped' in result:
+            continue
+        lines.append("{:<48} {:>12.0f} {:>12.0f} {:>7.2f}x".format(
+                     result['name'][:48], before['docs_per_sec'], result['docs_per_sec'],
+                     result['docs_per_sec'] / before['docs_per_sec']))
+    return "\n".join(lines)
+
+def _describe(result):
+    if 'skipped' in result:
+        return "{:<48} skipped ({})".format(result['name'][:48], result['skipped'])
+    peak = result['peak_memory_bytes']
+    return "{:<48} {:>10.0f} docs/s {:>11.0f} tokens/s {:>9}".format(
+           result['name'][:48], result['docs_per_sec'], result['tokens_per_sec'],
+           "-" if peak is None else "{:.0f} KiB".format(peak / 1024))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark custom_tokenizer on synthetic corpora and write the results as JSON.")
+    parser.add_argument("-o", "--output", default="-", help="JSON file to write, - for stdout (default)")
+    parser.add_argument("-n", "--docs", type=int, default=500, help="documents per corpus (default: 500)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="timed runs per case, the best is kept (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the corpora (default: 0)")
+    parser.add_argument("--group", action="append", choices=["tokenize", "rule", "split"],
+                        help="only run these groups, can be repeated (default: all)")
+    parser.add_argument("-k", "--filter", default=None, help="only run cases with this in their name")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run that measures peak memory")
+    parser.add_argument("--compare", default=None, metavar="JSON", help="an earlier output to compare the docs/s against")
+    args = parser.parse_args(argv)
+    if args.docs < 1 or args.repeat < 1:
+        parser.error("--docs and --repeat must be at least 1")
+
+    report = run(n_docs=args.docs, repeat=args.repeat, seed=args.seed, groups=args.group or ("tokenize", "rule", "split"),
+                 pattern=args.filter, memory=not args.no_memory, progress=lambda result: print(_describe(result), file=sys.stderr))
+    text = json.dumps(report, indent=1)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(report, json.load(f)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
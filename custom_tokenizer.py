@@ -1,7 +1,13 @@
-import nltk.data
-import spacy
+import collections
 import copy
+import functools
+import itertools
+import os
 import re
+import threading
+import time
+import types
+import weakref
 
 MONEY = '#MONEY#'
 NUMBER = '#NUMBER#'
@@ -35,19 +41,75 @@ DDSHORT = ['e.g.', 'a.m.', 'p.m.', 'i.e.', 'm.d.']
 DDSHORT_TOK = ['#EG#', '#AM#', '#PM#', '#IE#', '#MD#']
 NUMBER_POT = {1: 1, 2: 2, 3: 3, 4: 4, 5: 5, 6: 6, 7: 7, 8: 8, 9: 9}
 
+# names of the feature tags, in the order bundle_lists takes them
+FEATURE_TAGS = ('tag_acronym', 'tag_pnumber', 'tag_capital', 'tag_acapital')
+
+PUNKT_PATH = 'tokenizers/punkt/english.pickle'
+
+TWOWORDDOT_REGEXP = {r'[Mm][Rr][.]',
+                     r'[Dd][Rr][.]',
+                     r'[Jj][Rr][.]',
+                     r'[Cc][Oo][.]',
+                     r'[Mm][Aa][.]',
+                     r'[Bb][Cc][.]',
+                     r'[A][Dd][.]',
+                     r'[Mm][Aa][.]',
+                     r'[Aa][.][Mm]',
+                     r'[Pp][.][Mm]'}
+
+
+# a quote starts with " and a letter and ends with the first " that follows a non-space character
+_QUOTE_SPAN_RE = re.compile(r'([\"][A-Za-z]([\s\S]*?)([^\s][\"]))')
+# a dialogue line runs from a speaker "Name:" up to (not including) the next speaker
+_DIALOGUE_SPAN_RE = re.compile(r'(([A-Z][a-z]+\s)*([A-Z]{2,}|([A-Z][a-z]+))[:][\s\S]*?)(?=(([A-Z][a-z]+\s)*([A-Z]{2,}|([A-Z][a-z]+))[:]))')
+
+
+def _mask_spans(span_re, string, token):
+    """
+        Replace every match of span_re (group 1) with token in a single scan,
+        returns the masked string and the replaced texts in order
+    """
+    pieces = []
+    moved = []
+    last = 0
+    for match in span_re.finditer(string):
+        start, end = match.span(1)
+        pieces.append(string[last:start])
+        pieces.append(token)
+        moved.append(match.group(1))
+        last = end
+    if not moved:
+        return string, moved
+    pieces.append(string[last:])
+    return "".join(pieces), moved
+
+def _restore_spans(sentences, moved, token, suffix=""):
+    """
+        Put the masked texts back in place of token, the n-th token found over all sentences gets moved[n].
+        Every sentence is rebuilt with a single join and moved is left untouched.
+    """
+    token_re = re.compile(token)
+    new_sentences = []
+    cursor = 0
+    for sentence in sentences:
+        pieces = token_re.split(sentence)
+        if len(pieces) == 1:
+            new_sentences.append(sentence)
+            continue
+        if cursor + len(pieces) - 1 > len(moved):
+            raise IndexError("found more {} tokens than masked words".format(token))
+        parts = [pieces[0]]
+        for piece in pieces[1:]:
+            parts += [moved[cursor], suffix, piece]
+            cursor += 1
+        new_sentences.append("".join(parts))
+    return new_sentences
 
 def pre_quote_tokenize(paragraph=None, token='_quote_token'):
     """
         Quotes often contain multiple sentences, these sentences should not be split imo
     """
-    rexp = r'[\s\S]*?([\"][A-Za-z]([\s\S]*?)([^\s][\"]))'
-    moved_quotes = []
-    match = re.match(rexp, paragraph)
-    while match is not None:
-        moved_quotes.append(match.group(1))
-        paragraph = paragraph[:match.span(1)[0]] + token + paragraph[match.span(1)[1]:]
-        match = re.match(rexp, paragraph)
-    return paragraph, moved_quotes
+    return _mask_spans(_QUOTE_SPAN_RE, paragraph, token)
 
 def pre_dialogue_tokenize(string=None, token='_conversation_token. '):
     """
@@ -56,47 +118,22 @@ def pre_dialogue_tokenize(string=None, token='_conversation_token. '):
         Vender: Hello Kate...
         all dialogues should be turned into tokens
     """
-    # assert string is not None
-    # rexp = r'[\s\S]*?(([A-Z][a-z]+\s)*[A-Z][a-z]+[:][\s\S]*?)(([A-Z][a-z]+\s)*[A-Z][a-z]+[:])'
-    rexp = r'[\s\S]*?(([A-Z][a-z]+\s)*([A-Z]{2,}|([A-Z][a-z]+))[:][\s\S]*?)(([A-Z][a-z]+\s)*([A-Z]{2,}|([A-Z][a-z]+))[:])'
-    moved_dialogues = []
-    match = re.match(rexp, string)
-    while match is not None:
-        moved_dialogues.append(match.group(1))
-        span = match.span(1)
-        string = string[:span[0]] + token + string[span[1]:]
-        match = re.match(rexp, string)
-    return string, moved_dialogues
+    # the last speaker is kept in the text, the next dialogue line can start with it
+    return _mask_spans(_DIALOGUE_SPAN_RE, string, token)
 
 def post_dialogue_tokenize(sentences=None, moved_dialogues=None, token='_conversation_token.'):
     assert isinstance(sentences, list)
     """
         Put the line-breaking words back into the sentences after splitting with nltk-sentence-splitter
     """
-    new_sentences = []
-    for sentence in sentences:
-        match_spans = [m.span() for m in re.finditer(token, sentence)]
-        for i in range(len(match_spans) -1, -1, -1):
-            span = match_spans[i]
-            word = moved_dialogues.pop(i)
-            sentence = sentence[:span[0]] + word + " " + sentence[span[1]:]
-        new_sentences.append(sentence)
-    return new_sentences
+    return _restore_spans(sentences, moved_dialogues, token, suffix=" ")
 
 def post_quote_tokenize(sentences=None, moved_quotes=None, token='_quote_token'):
     assert isinstance(sentences, list)
     """
         Turn the quote tokens back into text after splitting with nltk-sentence-splitter
     """
-    new_sentences = []
-    for sentence in sentences:
-        match_spans = [m.span() for m in re.finditer(token, sentence)]
-        for i in range(len(match_spans) -1, -1, -1):
-            span = match_spans[i]
-            word = moved_quotes.pop(i)
-            sentence = sentence[:span[0]] + word + " " + sentence[span[1]:]
-        new_sentences.append(sentence)
-    return new_sentences
+    return _restore_spans(sentences, moved_quotes, token, suffix=" ")
 
 # string, moved_dialogues = pre_dialogue_tokenize()
 
@@ -107,65 +144,67 @@ def post_quote_tokenize(sentences=None, moved_quotes=None, token='_quote_token')
 # new_sentences = post_dialogue_tokenize(sentences=sentences, moved_dialogues=moved_dialogues, token='_conversation_token.')
 # print(new_sentences)
 
+# words ending with a dot that should not break the line
+_NO_LINE_BREAK_PATTERNS = [r'[A-Z][a-z]*[.]',
+                           r'[A-Za-z][.]([A-Za-z][.])+',
+                           r'[Nn]o[.] \d+',
+                           r'[Mm]r[.]',
+                           r'[a-z]+[.]"',
+                           r'et al[.]',
+                           r'Gov[.]',
+                           r'CMD[.]',
+                           r'SGT[.]',
+                           r'Sgt[.]']
+_NO_LINE_BREAK_SHIELDED = frozenset(['January.',
+                                     'February.',
+                                     'Mars.',
+                                     'April.',
+                                     'May.',
+                                     'June.',
+                                     'July.',
+                                     'August.',
+                                     'September.',
+                                     'Oktober.',
+                                     'November.',
+                                     'December.'])
+# stops at every position where at least one pattern matches and captures what each of them matches there
+_NO_LINE_BREAK_RE = re.compile("(?=" + "|".join(_NO_LINE_BREAK_PATTERNS) + ")" +
+                               "".join("(?=(?P<p{}>{})|)".format(i, reg) for i, reg in enumerate(_NO_LINE_BREAK_PATTERNS)))
+_NO_LINE_BREAK_GROUPS = [_NO_LINE_BREAK_RE.groupindex["p{}".format(i)] for i in range(len(_NO_LINE_BREAK_PATTERNS))]
+
+
 def pre_sentence_tokenize(string=None, token='no_line_break'):
     """
         Move line-breaking words that should not break the line and replace them with a token
         before utilizing the nltk-sentence tokenizer.
     """
     assert string is not None
-    regular_ex = [r'[A-Z][a-z]*[.]',
-                  r'[A-Za-z][.]([A-Za-z][.])+',
-                  r'[Nn]o[.] \d+',
-                  r'[Mm]r[.]',
-                  r'[a-z]+[.]"',
-                  r'et al[.]',
-                  r'Gov[.]',
-                  r'CMD[.]',
-                  r'SGT[.]',
-                  r'Sgt[.]']
-    shielded_words = ['January.',
-                      'February.',
-                      'Mars.',
-                      'April.',
-                      'May.',
-                      'June.',
-                      'July.',
-                      'August.',
-                      'September.',
-                      'Oktober.',
-                      'November.',
-                      'December.']
-
-    iterators = [re.finditer(reg, string) for reg in regular_ex]
-    tuples = [(item.group(), item.span()) for iterator in iterators for item in iterator if item.group() not in shielded_words]
-    tuples.sort(key=lambda x: (x[1][0], x[1][1]))
-    if not tuples:
-        return string, []
-    # remove words found that overlap each other
-    save_tuples = [tuples[0]]
-    i = 1
-    span_start = tuples[0][1][0]
-    span_end = tuples[0][1][1]
-    while i < len(tuples):
-        new_span_start = tuples[i][1][0]
-        new_span_end = tuples[i][1][1]
-        if new_span_start > span_end:
-            save_tuples.append(tuples[i])
-            span_start = tuples[i][1][0]
-            span_end = tuples[i][1][1]
-        elif span_start == new_span_start and span_end < new_span_end:
-            save_tuples.pop(-1)
-            save_tuples.append(tuples[i])
-            span_end = tuples[i][1][1]
-        i += 1
-
-    # put token in place of line-breaking words
+    # every pattern continues searching after its own previous match, as if it was run with re.finditer by itself
+    resume = [0] * len(_NO_LINE_BREAK_GROUPS)
+    pieces = []
     moved_words = []
-    for i in range(len(save_tuples) -1, -1, -1):
-        word, span = save_tuples[i]
-        string = string[:span[0]] + token + string[span[1]:]
-        moved_words.insert(0, word)
-    return string, moved_words
+    last_end = -1
+    copied = 0
+    for match in _NO_LINE_BREAK_RE.finditer(string):
+        start = match.start()
+        end = -1
+        for i, group in enumerate(_NO_LINE_BREAK_GROUPS):
+            word_end = match.end(group)
+            if word_end == -1 or start < resume[i]:
+                continue
+            resume[i] = word_end
+            if word_end > end and string[start:word_end] not in _NO_LINE_BREAK_SHIELDED:
+                end = word_end
+        # keep the longest word at each position, skip words that overlap or touch the previous one
+        if end != -1 and start > last_end:
+            pieces.append(string[copied:start])
+            pieces.append(token)
+            moved_words.append(string[start:end])
+            last_end = copied = end
+    if not moved_words:
+        return string, []
+    pieces.append(string[copied:])
+    return "".join(pieces), moved_words
 
 # s = "ATLANTA, Georgia -- Going back to work after my wife had our first child was an emotional roller coaster.\n\n\n\nThe author says that being \"Mr. Mom\" is appealing, but putting the idea into practice is harder than it looks."
 # string, moved_words = pre_sentence_tokenize(s)
@@ -176,22 +215,63 @@ def post_sentence_tokenize(sentences=None, moved_words=None, token='no_line_brea
     """
         Put the line-breaking words back into the sentences after splitting with nltk-sentence-splitter
     """
-    new_sentences = []
-    for sentence in sentences:
-        match_spans = [m.span() for m in re.finditer(token, sentence)]
-        for i in range(len(match_spans) -1, -1, -1):
-            span = match_spans[i]
-            word = moved_words.pop(i)
-            sentence = sentence[:span[0]] + word + sentence[span[1]:]
-        new_sentences.append(sentence)
-    return new_sentences
+    return _restore_spans(sentences, moved_words, token)
 
 
-def wrapped_nltk_sentence_split(nltk_tokenizer=None, paragraph=None, verbose=False, use_dialogue=False, use_quote=False):
+class PunktSentenceSplitter():
+    """
+        Holds one loaded nltk punkt model and splits paragraphs with it directly,
+        instead of going through nltk.tokenize.sent_tokenize which looks the model up on every call.
+        Can be passed as nltk_tokenizer to wrapped_nltk_sentence_split.
+    """
+    def __init__(self, path=PUNKT_PATH):
+        self.path = path
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    # nltk is slow to import, only pay for it when the splitter is first needed
+                    import nltk.data
+                    self._tokenizer = nltk.data.load(self.path)
+        return self
+
+    def sent_tokenize(self, paragraph):
+        return self.load()._tokenizer.tokenize(paragraph)
+
+    def __call__(self, paragraph):
+        return self.sent_tokenize(paragraph)
+
+
+_punkt_splitter = PunktSentenceSplitter()
+
+def get_punkt_splitter(preload=False):
+    """
+        Return the process-wide punkt splitter, call with preload=True at worker startup to load the model up front
+    """
+    if preload:
+        _punkt_splitter.load()
+    return _punkt_splitter
+
+
+def wrapped_nltk_sentence_split(nltk_tokenizer=None, paragraph=None, verbose=False, use_dialogue=False, use_quote=False, cache=None):
+    """
+        Split paragraph into sentences with nltk_tokenizer, the process-wide punkt splitter by default.
+        cache can be a ResultCache, the sentences are then looked up by paragraph and split only once.
+    """
     assert paragraph
     if not nltk_tokenizer:
-        nltk.data.load('tokenizers/punkt/english.pickle')
-        nltk_tokenizer = nltk.tokenize
+        nltk_tokenizer = _punkt_splitter
+
+    if cache is not None and not verbose:
+        fingerprint = _splitter_fingerprint(_splitter_name(nltk_tokenizer), use_dialogue, use_quote)
+        sentences = cache.get(fingerprint, paragraph)
+        if sentences is None:
+            sentences = wrapped_nltk_sentence_split(nltk_tokenizer, paragraph, use_dialogue=use_dialogue, use_quote=use_quote)
+            cache.put(fingerprint, paragraph, sentences)
+        return list(sentences)
 
     # change some shortenings with "." to words without dots
     ccwwd = change_capital_words_with_dot()
@@ -228,9 +308,258 @@ def wrapped_nltk_sentence_split(nltk_tokenizer=None, paragraph=None, verbose=Fal
         print("end of wrapped_nltk_sentence_split")
     return sentences
 
+class Diagnostics():
+    """
+        Counts of the events rules report while tokenizing, such as quotes that are never closed or numbers
+        that can't be bundled, with up to `samples` examples of each event picked uniformly at random.
+        With stream every event is also written to it as a line, as the rules used to print them.
+        Collectors of several processes can be pickled and added together with merge.
+    """
+    def __init__(self, samples=0, stream=None):
+        self.samples = samples
+        self.stream = stream
+        self.counts = collections.Counter()
+        self.examples = {}
+        self._lock = threading.Lock()
+        self._random = None
+
+    def __getstate__(self):
+        return {'samples': self.samples, 'counts': self.counts, 'examples': self.examples}
+
+    def __setstate__(self, state):
+        self.__init__(samples=state['samples'])
+        self.counts = state['counts']
+        self.examples = state['examples']
+
+    def record(self, event, example=None):
+        with self._lock:
+            self.counts[event] += 1
+            if self.samples and example is not None:
+                examples = self.examples.setdefault(event, [])
+                if len(examples) < self.samples:
+                    examples.append(example)
+                else:
+                    # reservoir sampling, every example of the event is kept with the same probability
+                    j = self._get_random().randrange(self.counts[event])
+                    if j < self.samples:
+                        examples[j] = example
+        if self.stream is not None:
+            self.stream.write(event if example is None else "{}: {}".format(event, example))
+            self.stream.write("\n")
+
+    def _get_random(self):
+        if self._random is None:
+            import random
+            self._random = random.Random(0)
+        return self._random
+
+    def merge(self, other):
+        """
+            Add the counts and examples of other, such as a collector returned by a worker process.
+            The examples of both are drawn from in proportion to their counts, so they stay a uniform sample of all events.
+        """
+        with self._lock:
+            for event, examples in other.examples.items():
+                mine = self.examples.get(event, [])
+                self.examples[event] = self._merge_examples(mine, self.counts[event], examples, other.counts[event])
+            self.counts.update(other.counts)
+        return self
+
+    def _merge_examples(self, mine, mine_count, theirs, theirs_count):
+        """
+            Up to `samples` examples out of two uniform samples of mine_count and theirs_count events
+        """
+        rng = self._get_random()
+        mine, theirs = list(mine), list(theirs)
+        rng.shuffle(mine)
+        rng.shuffle(theirs)
+        mine_count, theirs_count = max(mine_count, len(mine)), max(theirs_count, len(theirs))
+        merged = []
+        while len(merged) < self.samples and (mine or theirs):
+            # the next example comes from either side with the share of events that side has left
+            if mine and (not theirs or rng.randrange(mine_count + theirs_count) < mine_count):
+                merged.append(mine.pop())
+                mine_count -= 1
+            else:
+                merged.append(theirs.pop())
+                theirs_count -= 1
+        return merged
+
+    def take(self):
+        """
+            Return a collector with everything recorded so far and start over
+        """
+        taken = Diagnostics(samples=self.samples)
+        with self._lock:
+            taken.counts, self.counts = self.counts, collections.Counter()
+            taken.examples, self.examples = self.examples, {}
+        return taken
+
+    def reset(self):
+        self.take()
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def as_dict(self):
+        with self._lock:
+            return {event: {'count': count, 'examples': list(self.examples.get(event, []))}
+                    for event, count in self.counts.most_common()}
+
+    def report(self):
+        lines = []
+        for event, entry in self.as_dict().items():
+            lines.append("{:>9} {}".format(entry['count'], event))
+            for example in entry['examples']:
+                lines.append("          {!r}".format(example))
+        return "\n".join(lines)
+
+
+# the collector events are recorded in, None when diagnostics are disabled
+_diagnostics = None
+
+def enable_diagnostics(samples=0, stream=None, diagnostics=None):
+    """
+        Start recording the events of the rules of this process in diagnostics, a new Diagnostics by default, and return it
+    """
+    global _diagnostics
+    _diagnostics = diagnostics if diagnostics is not None else Diagnostics(samples=samples, stream=stream)
+    return _diagnostics
+
+def disable_diagnostics():
+    """
+        Stop recording events and return the collector, events then cost one check of a global
+    """
+    global _diagnostics
+    diagnostics, _diagnostics = _diagnostics, None
+    return diagnostics
+
+def get_diagnostics():
+    return _diagnostics
+
+# number of words every word shape cache holds before it drops the least recently used
+WORD_SHAPE_CACHE_SIZE = 2 ** 16
+
+_word_shape_caches = {}
+
+def word_shape_cache(function):
+    """
+        Memoize a classification of a single word in a bounded LRU cache, shared by all documents
+        tokenized in the process. Natural text repeats a small vocabulary, so most words are only classified once.
+    """
+    cached = functools.lru_cache(maxsize=WORD_SHAPE_CACHE_SIZE)(function)
+    _word_shape_caches[function.__qualname__] = cached
+    return cached
+
+def word_shape_cache_info():
+    """
+        Hits, misses, size and hit rate of every word shape cache by the name of the classification
+    """
+    info = {}
+    for name, cached in _word_shape_caches.items():
+        hits, misses, maxsize, size = cached.cache_info()
+        info[name] = {'hits': hits,
+                      'misses': misses,
+                      'maxsize': maxsize,
+                      'size': size,
+                      'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+    return info
+
+def clear_word_shape_caches():
+    for cached in _word_shape_caches.values():
+        cached.cache_clear()
+
+
+class CharacterMap():
+    """
+        Replace single characters, it can take the place of a (pattern, replacement) pair in the _substitutions of a rule.
+        Mapping a character to "" removes it, with drop_non_ascii every non-ASCII character left afterwards is removed too.
+        Text that is all ASCII only needs str.replace for the ASCII characters of the map, other text is mapped with one str.translate.
+    """
+    def __init__(self, mapping, drop_non_ascii=False):
+        self.mapping = dict(mapping)
+        self.drop_non_ascii = drop_non_ascii
+        # matches the characters sub changes, only compiled when offsets are tracked
+        self._changed = None
+        self._table = {code: code for code in range(128)}
+        self._table.update((ord(char), replacement or None) for char, replacement in self.mapping.items())
+        self._ascii_replacements = [(char, replacement) for char, replacement in self.mapping.items() if char.isascii()]
+        # replacing one character after the other only equals translating when no replacement holds a mapped character
+        if any(char in replacement for char, _ in self._ascii_replacements for _, replacement in self._ascii_replacements):
+            self._ascii_replacements = None
+
+    def sub(self, replacement, s):
+        """
+            Same signature as re.Pattern.sub so the map fits in _compiled_substitutions, replacement is not used
+        """
+        if self._ascii_replacements is not None and s.isascii():
+            for char, replacement in self._ascii_replacements:
+                s = s.replace(char, replacement)
+            return s
+        if self.mapping:
+            s = s.translate(self._table)
+        if self.drop_non_ascii:
+            s = s.encode("ascii", "ignore").decode()
+        return s
+
+    def edits(self, s):
+        """
+            (start, end, replacement) of every character of s that sub changes
+        """
+        if self._changed is None:
+            characters = "".join(re.escape(char) for char in self.mapping)
+            self._changed = re.compile("[" + characters + ("\x80-\U0010ffff" if self.drop_non_ascii else "") + "]")
+        edits = []
+        for match in self._changed.finditer(s):
+            start = match.start()
+            replacement = self.mapping.get(match.group(), "")
+            if self.drop_non_ascii:
+                replacement = replacement.encode("ascii", "ignore").decode()
+            edits.append((start, start + 1, replacement))
+        return edits
+
+
+# while a pipeline tracks offsets, substitute() appends (before, after, edits) of every substitution
+# that changed the string to steps, per thread
+_substitution_log = threading.local()
+
+def _substitute_logged(substitutions, s, steps):
+    """
+        Apply the compiled substitutions to s like substitute() and log the (start, end, replacement) of every change
+    """
+    for regexp, replacement in substitutions:
+        if isinstance(regexp, CharacterMap):
+            edits = regexp.edits(s)
+            new = regexp.sub(replacement, s)
+        else:
+            edits = []
+            def expand(match, replacement=replacement, edits=edits):
+                text = replacement(match) if callable(replacement) else match.expand(replacement)
+                if text != match.group():
+                    edits.append((match.start(), match.end(), text))
+                return text
+            new = regexp.sub(expand, s)
+        if new != s:
+            steps.append((s, new, edits))
+            s = new
+    return s
+
+# guards compiling rule classes and building shared pipelines, reentrant since building a pipeline compiles its rules
+_compile_lock = threading.RLock()
+
 class TokenizeRule():
+    # regular expressions used by the rule, compiled once per rule class into attributes with the same names
+    _patterns = {}
+    # (pattern, replacement) pairs that substitute() applies to the string in order
+    _substitutions = []
+    # rules that work on the words of the string set this and implement use_tokens(f_holder, tokens)
+    _takes_tokens = False
+    # rules that change every word on its own also set this and implement use_word(f_holder, word),
+    # the pipeline runs consecutive word level rules in one loop over the words
+    _word_level = False
 
     def __init__(self):
+        self.compile()
         self.feature_money = MONEY
         self.feature_acronym = ACRONYM
         self.LDQ = LDQ
@@ -257,225 +586,316 @@ class TokenizeRule():
                          }
 
         self.shortwords = ['mr.', 'dr.', 'sr.', 'jr.', 'etc.', '...']
+
+    @classmethod
+    def compile(cls):
+        """
+            Compile the regular expressions of the rule, this is done once per rule class
+            and the compiled patterns are shared by all instances
+        """
+        if not cls.__dict__.get('_is_compiled', False):
+            with _compile_lock:
+                if not cls.__dict__.get('_is_compiled', False):
+                    for name, pattern in cls._patterns.items():
+                        setattr(cls, name, re.compile(pattern))
+                    cls._compiled_substitutions = [(substitution, None) if isinstance(substitution, CharacterMap) else
+                                                   (re.compile(substitution[0]), substitution[1]) for substitution in cls._substitutions]
+                    cls._is_compiled = True
+        return cls
+
+    def substitute(self, s):
+        steps = getattr(_substitution_log, 'steps', None)
+        if steps is not None:
+            return _substitute_logged(self._compiled_substitutions, s, steps)
+        for regexp, replacement in self._compiled_substitutions:
+            s = regexp.sub(replacement, s)
+        return s
+
+    def use(self, f_holder, s):
+        """
+            String interface of rules that take tokens. use_tokens gets s split on " ", it may change the list
+            in place and returns either a list of tokens without " " in them or a string.
+        """
+        f_holder, result = self.use_tokens(f_holder, s.split(" "))
+        if not isinstance(result, str):
+            result = " ".join(result)
+        return f_holder, result
+
+    def use_tokens(self, f_holder, tokens):
+        """
+            Token interface of word level rules, every word is replaced by the word or list of words use_word returns for it
+        """
+        return f_holder, _transform_words(f_holder, tokens, (self.use_word,))
+
     def __str__(self):
         return self._name
 
 
-class FeatureHolder():
-    def __init__(self):
+def _transform_words(f_holder, tokens, uses, first=0, words=None):
+    """
+        Run the use_word functions uses[first:] on every token, in order, and return the list of words.
+        When one of them returns a list of words the remaining ones get these words one by one.
+        Each rule still sees the words in order, only the rules are interleaved word by word.
+    """
+    if words is None:
+        words = []
+    n_uses = len(uses)
+    for word in tokens:
+        for k in range(first, n_uses):
+            word = uses[k](f_holder, word)
+            if not isinstance(word, str):
+                _transform_words(f_holder, word, uses, k + 1, words)
+                break
+        else:
+            words.append(word)
+    return words
 
-        self.raw_string = None
-        self.with_feature = None
-        self.without_feature = None
 
-        self.feature_ddshort_list = DDSHORT
-        self.feature_ddshort_tok_list = DDSHORT_TOK
-
-        self.acronym_token = "ACRONYM"
-        self.acapital_token = "ACAPITAL"
-
-        # default meta-characters
-        self.default_dash = "-"
-        self.default_ldash = "—"
-        self.default_ldq = '"'
-        self.default_rdq = '"'
-        self.default_lsq = "'"
-        self.default_rsq = "'"
-        self.default_lrb = "("
-        self.default_rrb = ")"
-        self.default_lsb = "["
-        self.default_rsb = "]"
-        self.default_lcb = "{"
-        self.default_rcb = "}"
-
-        # features are words that are exchanged for tokens in the text
-        self.feature_money = MONEY
-        self.feature_time = TIME
-        self.feature_acronym = ACRONYM
-        self.feature_number = NUMBER
-        self.feature_acapital = ACAPITAL
-        self.feature_http = HTTP
-        self.feature_tdot = TDOT
-        self.feature_ldq = LDQ
-        self.feature_rdq = RDQ
-        self.feature_lsq = LSQ
-        self.feature_rsq = RSQ
-        self.feature_dash = DASH
-        self.feature_ldash = LDASH
-        self.feature_rrb = "#RRB#"
-        self.feature_lrb = "#LRB#"
-        self.feature_rsb = "#RSB#"
-        self.feature_lsb = "#LSB#"
-        self.feature_rcb = "#RCB#"
-        self.feature_lcb = "#LCB#"
-        self.twoworddot_replacement = "#TWOWORDDOT#"
-
-        self.default_to_feature_map =  {self.feature_dash: self.default_dash,
-                                        self.feature_ldash: self.default_ldash,
-                                        self.feature_ldq: self.default_ldq,
-                                        self.feature_rdq: self.default_rdq,
-                                        self.feature_rsq: self.default_rsq,
-                                        self.feature_lsq: self.default_lsq,
-                                        self.feature_rrb: self.default_rrb,
-                                        self.feature_lrb: self.default_lrb,
-                                        self.feature_rsb: self.default_rsb,
-                                        self.feature_lsb: self.default_lsb,
-                                        self.feature_rcb: self.default_rcb,
-                                        self.feature_lcb: self.default_lcb,
-                                        }
-
-        self.three_word_dot = {r'[Ee]tc'}
-
-        self.twoworddot_regexp = {r'[Mm][Rr][.]',
-                                  r'[Dd][Rr][.]',
-                                  r'[Jj][Rr][.]',
-                                  r'[Cc][Oo][.]',
-                                  r'[Mm][Aa][.]',
-                                  r'[Bb][Cc][.]',
-                                  r'[A][Dd][.]',
-                                  r'[Mm][Aa][.]',
-                                  r'[Aa][.][Mm]',
-                                  r'[Pp][.][Mm]'}
-
-        self.short_words = {'mr.': 'MRDOT',
-                            'dr.': 'DRDOT',
-                            'sr.': 'SRDOT',
-                            'jr.': 'JRDOT',
-                            'etc.': 'ETCDOT',
-                            '...': 'DOTDOTDOT',
-                            'e.g.': '#EG#',
-                            'a.m.': '#AM#',
-                            'p.m.': '#PM#',
-                            'i.e.': '#IE#',
-                            'm.d.': '#MD#',
-                            }
-
-        self.short_words_rev = {self.short_words[key]: key for key in self.short_words.keys()}
-
-        self.feature_tag_pnumber_dict = NUMBER_POT
-
-        # feature_list used for acapital not to overwrite other features during pre-processing
-        self.feature_list = [self.feature_money,
-                             self.feature_time,
-                             self.feature_acronym,
-                             self.feature_number,
-                             self.feature_acapital,
-                             self.feature_http,
-                             self.feature_tdot,
-                             self.feature_ldq,
-                             self.feature_rdq,
-                             self.feature_lsq,
-                             self.feature_rsq,
-                             self.feature_dash,
-                             self.feature_ldash,
-                             self.twoworddot_replacement,
-                             ]
+_NUMBER_APOSTROPHE_RE = re.compile(r'(\d+)\'(\d+)')
+_DOTTED_ACRONYM_RE = re.compile(r'([a-zA-Z]+[.]([a-zA-Z]+[.])+)')
 
 
+def _normalize_number(word):
+    """
+        Remove "," from a number and write 1'000 style separators as decimal points,
+        most numbers have neither so the regular expression is only run when it can match
+    """
+    if ',' in word:
+        word = word.replace(',', '')
+    if "'" in word:
+        word = _NUMBER_APOSTROPHE_RE.sub(r'\1.\2', word)
+    return word
+
+@word_shape_cache
+def _number_shape(word):
+    """
+        The number as it is written in the tokens and the number of digits of its rounded value,
+        None for the digits when the number has a bad character
+    """
+    # keep . because it represents decimals, remove "," convention.
+    word = _normalize_number(word)
+    try:
+        length = len(str(round(float(word))))
+    except:
+        length = None
+    if word[0:2] == '0.':
+        return word[1:], length
+    return word, length
 
-        # these features are kept as tags during training
-        self.feature_tag_acronym = []
-        self.feature_tag_pnumber = []
-        self.feature_tag_capital = []
-        self.feature_tag_acapital = []
-        self.feature_tag_answer = []
 
-        # these features are turned back into words after pre-processing
-        self.feature_money_list = []
-        self.feature_time_list = []
-        self.feature_acronym_list = []
-        self.feature_number_list = []
-        self.feature_acapital_list = []
-        # start using other word for non-tokens
-        self.separate_twoworddot_list = []
+class FeatureHolder():
+    """
+        Holds the features of one string while it is tokenized.
+        The feature tokens and lookup tables are read-only class attributes shared by every holder,
+        an instance only carries the lists that are filled for the current string.
+    """
+    __slots__ = ('raw_string', 'with_feature', 'without_feature',
+                 'feature_tag_acronym', 'feature_tag_pnumber', 'feature_tag_capital', 'feature_tag_acapital', 'feature_tag_answer',
+                 'feature_money_list', 'feature_time_list', 'feature_acronym_list', 'feature_number_list', 'feature_acapital_list',
+                 'separate_twoworddot_list', 'offsets')
+
+    feature_ddshort_list = tuple(DDSHORT)
+    feature_ddshort_tok_list = tuple(DDSHORT_TOK)
+    feature_ddshort_map = types.MappingProxyType(dict(zip(DDSHORT, DDSHORT_TOK)))
+
+    acronym_token = "ACRONYM"
+    acapital_token = "ACAPITAL"
+
+    # default meta-characters
+    default_dash = "-"
+    default_ldash = "—"
+    default_ldq = '"'
+    default_rdq = '"'
+    default_lsq = "'"
+    default_rsq = "'"
+    default_lrb = "("
+    default_rrb = ")"
+    default_lsb = "["
+    default_rsb = "]"
+    default_lcb = "{"
+    default_rcb = "}"
+
+    # features are words that are exchanged for tokens in the text
+    feature_money = MONEY
+    feature_time = TIME
+    feature_acronym = ACRONYM
+    feature_number = NUMBER
+    feature_acapital = ACAPITAL
+    feature_http = HTTP
+    feature_tdot = TDOT
+    feature_ldq = LDQ
+    feature_rdq = RDQ
+    feature_lsq = LSQ
+    feature_rsq = RSQ
+    feature_dash = DASH
+    feature_ldash = LDASH
+    feature_rrb = "#RRB#"
+    feature_lrb = "#LRB#"
+    feature_rsb = "#RSB#"
+    feature_lsb = "#LSB#"
+    feature_rcb = "#RCB#"
+    feature_lcb = "#LCB#"
+    twoworddot_replacement = "#TWOWORDDOT#"
+
+    default_to_feature_map = types.MappingProxyType({feature_dash: default_dash,
+                                                     feature_ldash: default_ldash,
+                                                     feature_ldq: default_ldq,
+                                                     feature_rdq: default_rdq,
+                                                     feature_rsq: default_rsq,
+                                                     feature_lsq: default_lsq,
+                                                     feature_rrb: default_rrb,
+                                                     feature_lrb: default_lrb,
+                                                     feature_rsb: default_rsb,
+                                                     feature_lsb: default_lsb,
+                                                     feature_rcb: default_rcb,
+                                                     feature_lcb: default_lcb,
+                                                     })
+
+    three_word_dot = frozenset({r'[Ee]tc'})
+
+    twoworddot_regexp = frozenset(TWOWORDDOT_REGEXP)
+
+    short_words = types.MappingProxyType({'mr.': 'MRDOT',
+                                          'dr.': 'DRDOT',
+                                          'sr.': 'SRDOT',
+                                          'jr.': 'JRDOT',
+                                          'etc.': 'ETCDOT',
+                                          '...': 'DOTDOTDOT',
+                                          'e.g.': '#EG#',
+                                          'a.m.': '#AM#',
+                                          'p.m.': '#PM#',
+                                          'i.e.': '#IE#',
+                                          'm.d.': '#MD#',
+                                          })
+
+    short_words_rev = types.MappingProxyType({value: key for key, value in short_words.items()})
+
+    feature_tag_pnumber_dict = types.MappingProxyType(NUMBER_POT)
+
+    # feature_list used for acapital not to overwrite other features during pre-processing
+    feature_list = frozenset({feature_money,
+                              feature_time,
+                              feature_acronym,
+                              feature_number,
+                              feature_acapital,
+                              feature_http,
+                              feature_tdot,
+                              feature_ldq,
+                              feature_rdq,
+                              feature_lsq,
+                              feature_rsq,
+                              feature_dash,
+                              feature_ldash,
+                              twoworddot_replacement,
+                              })
 
+    def __init__(self):
+        self.reset()
 
     def set_raw_string(self, raw_string=None):
         self.raw_string = raw_string
 
     def reset(self):
+        # these features are kept as tags during training
         self.feature_tag_acronym = []
         self.feature_tag_pnumber = []
         self.feature_tag_capital = []
         self.feature_tag_acapital = []
         self.feature_tag_answer = []
 
+        # these features are turned back into words after pre-processing
         self.feature_money_list = []
         self.feature_time_list = []
         self.feature_acronym_list = []
         self.feature_number_list = []
         self.feature_acapital_list = []
-
+        # start using other word for non-tokens
         self.separate_twoworddot_list = []
 
         self.raw_string = None
         self.with_feature = None
         self.without_feature = None
+        # (start, end) in raw_string of every token, only when the tokenizer was asked for offsets
+        self.offsets = None
 
-    def bundle_lists(self, s):
-        self.with_feature = s.split(" ")
-        self.without_feature = copy.deepcopy(self.with_feature)
-
-        self.feature_tag_acronym = [0] * len(self.with_feature)
-        self.feature_tag_pnumber = [0] * len(self.with_feature)
-        self.feature_tag_capital = [0] * len(self.with_feature)
-        self.feature_tag_acapital = [0] * len(self.with_feature)
-
-        for i, word in enumerate(self.with_feature):
+    def bundle_lists(self, s, tags=None):
+        """
+            Exchange the feature tokens in s back for the words they replaced and tag the features.
+            The feature lists are consumed front to back through deques, the lists themselves are left as they are.
+            tags can be four zeroed sequences as long as the words of s, in the order of FEATURE_TAGS,
+            such as the rows of a NumPy array, the tags are then written into them instead of new lists.
+        """
+        with_feature = s.split(" ")
+        without_feature = with_feature[:]
+        self.with_feature = with_feature
+        self.without_feature = without_feature
+
+        if tags is None:
+            n_words = len(with_feature)
+            tags = ([0] * n_words, [0] * n_words, [0] * n_words, [0] * n_words)
+        feature_tag_acronym, feature_tag_pnumber, feature_tag_capital, feature_tag_acapital = tags
+        self.feature_tag_acronym = feature_tag_acronym
+        self.feature_tag_pnumber = feature_tag_pnumber
+        self.feature_tag_capital = feature_tag_capital
+        self.feature_tag_acapital = feature_tag_acapital
+
+        money_words = collections.deque(self.feature_money_list)
+        time_words = collections.deque(self.feature_time_list)
+        acronym_words = collections.deque(self.feature_acronym_list)
+        number_words = collections.deque(self.feature_number_list)
+        acapital_words = collections.deque(self.feature_acapital_list)
+        twoworddot_words = collections.deque(self.separate_twoworddot_list)
+
+        pnumber_dict = self.feature_tag_pnumber_dict
+        pnumber_default = len(pnumber_dict) + 1
+        default_to_feature_map = self.default_to_feature_map
+        short_words_rev = self.short_words_rev
+        feature_list = self.feature_list
+
+        for i, word in enumerate(with_feature):
             # Money
-            if word == self.feature_money:
-                self.without_feature[i] = self.feature_money_list.pop(0)
+            if word == MONEY:
+                without_feature[i] = money_words.popleft()
 
             # Time
-            elif word == self.feature_time:
-                self.without_feature[i] = self.feature_time_list.pop(0)
+            elif word == TIME:
+                without_feature[i] = time_words.popleft()
 
             # Acronyms
-            elif word == self.feature_acronym:
-                self.without_feature[i] = self.feature_acronym_list.pop(0)
-                self.feature_tag_acronym[i] = 1
+            elif word == ACRONYM:
+                without_feature[i] = acronym_words.popleft()
+                feature_tag_acronym[i] = 1
 
             # Numbers
-            elif word == self.feature_number:
-                self.without_feature[i] = self.feature_number_list.pop(0)
-                # keep . because it represents decimals, remove "," convention.
-                word = self.without_feature[i]
-                word = re.sub(r'[,]', '', word)
-                word = re.sub(r'(\d+)\'(\d+)', r'\1.\2', word)
-                if len(word) > 1 and word[0:2] == '0.':
-                    self.without_feature[i] = word[1:]
-                else:
-                    self.without_feature[i] = word
+            elif word == NUMBER:
+                number_word = number_words.popleft()
+                without_feature[i], length = _number_shape(number_word)
                 # if we have an error, we have a bad character in the word
-                try:
-                    length = len(str(round(float(word))))
-                except:
-                    print("Bad character in feature numbers")
+                if length is None:
+                    if _diagnostics is not None:
+                        _diagnostics.record("bundle_lists.bad_number", number_word)
                     return False
-                if length in self.feature_tag_pnumber_dict:
-                    self.feature_tag_pnumber[i] = self.feature_tag_pnumber_dict[length]
-                else:
-                    self.feature_tag_pnumber[i] = len(self.feature_tag_pnumber_dict) + 1
+                feature_tag_pnumber[i] = pnumber_dict.get(length, pnumber_default)
 
             # All capital words
-            elif word == self.feature_acapital:
-                self.without_feature[i] = self.feature_acapital_list.pop(0)
-                self.feature_tag_acapital[i] = 1
+            elif word == ACAPITAL:
+                without_feature[i] = acapital_words.popleft()
+                feature_tag_acapital[i] = 1
 
             # Fix other features that are just masks
-            elif word in self.default_to_feature_map:
-                self.without_feature[i] = self.default_to_feature_map[ word ]
+            elif word in default_to_feature_map:
+                without_feature[i] = default_to_feature_map[ word ]
 
-            elif word in self.short_words_rev:
-                self.without_feature[i] = self.short_words_rev[ word ]
+            elif word in short_words_rev:
+                without_feature[i] = short_words_rev[ word ]
 
             elif word == self.twoworddot_replacement:
-                self.without_feature[i] = self.separate_twoworddot_list.pop(0)
+                without_feature[i] = twoworddot_words.popleft()
 
             # Capital first letter
-            elif len(word) > 0:
-                if word[0].isupper() and not word in self.feature_list and len(word) > 1:
-                    self.feature_tag_capital[i] = 1
+            elif len(word) > 1:
+                if word[0].isupper() and not word in feature_list:
+                    feature_tag_capital[i] = 1
 
         return True
 
@@ -483,68 +903,1129 @@ class FeatureHolder():
         """
             Exchange words that will be split 'wrongly' by Spacy by tokens
             after Spacy tokenization we will move exchange them back.
+            The words are exchanged in a new list, results handed out before keep the old one.
         """
-        assert len(self.feature_acronym_list) == 0
+        # bundle_lists leaves the feature lists as they are, start new ones for the exchanged words
+        self.feature_acronym_list = []
+        self.feature_acapital_list = []
 
-        for i, word in enumerate(self.without_feature):
-            match = re.match(r'([a-zA-Z]+[.]([a-zA-Z]+[.])+)', word)
+        without_feature = self.without_feature = list(self.without_feature)
+        for i, word in enumerate(without_feature):
+            match = _DOTTED_ACRONYM_RE.match(word)
             if match:
                 self.feature_acronym_list.append(word)
-                self.without_feature[i] = self.acronym_token
+                without_feature[i] = self.acronym_token
             elif word.isupper() and word not in self.feature_list and len(word) > 3:
                 self.feature_acapital_list.append(word)
-                self.without_feature[i] = self.acapital_token
+                without_feature[i] = self.acapital_token
 
     def after_spacy(self):
-        for i, word in enumerate(self.without_feature):
+        acronym_words = collections.deque(self.feature_acronym_list)
+        acapital_words = collections.deque(self.feature_acapital_list)
+        without_feature = self.without_feature = list(self.without_feature)
+        for i, word in enumerate(without_feature):
             if word == self.acronym_token:
-                self.without_feature[i] = self.feature_acronym_list.pop(0)
+                without_feature[i] = acronym_words.popleft()
             elif word == self.acapital_token:
-                self.without_feature[i] = self.feature_acapital_list.pop(0)
+                without_feature[i] = acapital_words.popleft()
+
+    def copy(self):
+        """
+            A holder with copies of the lists of this one, changing either leaves the other as it is
+        """
+        f_holder = FeatureHolder.__new__(FeatureHolder)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            setattr(f_holder, name, list(value) if isinstance(value, list) else value)
+        return f_holder
 
     def get_tokens(self):
         return self.without_feature
 
+    def get_offsets(self):
+        return self.offsets
+
     def get_features(self):
         return {'tag_acronym': self.feature_tag_acronym,
                 'tag_pnumber': self.feature_tag_pnumber,
                 'tag_capital': self.feature_tag_capital,
                 'tag_acapital': self.feature_tag_acapital,}
 
+    def get_values(self):
+        return {'money': self.feature_money_list,
+                'time': self.feature_time_list,
+                'acronym': self.feature_acronym_list,
+                'number': self.feature_number_list,
+                'acapital': self.feature_acapital_list,
+                'twoworddot': self.separate_twoworddot_list,}
+
+    def get_result(self):
+        """
+            The state of the holder as a TokenizeResult, sharing the lists instead of copying them
+        """
+        return TokenizeResult(self.raw_string, self.with_feature, self.without_feature, self.get_features(), self.get_values(), self.offsets)
+
+    @classmethod
+    def from_result(cls, result):
+        """
+            A holder in the state result was taken from, with copies of the lists of result
+        """
+        f_holder = cls()
+        f_holder.raw_string = result.raw_string
+        f_holder.with_feature = list(result.with_feature)
+        f_holder.without_feature = list(result.tokens)
+        features = result.features
+        f_holder.feature_tag_acronym = list(features.get('tag_acronym', []))
+        f_holder.feature_tag_pnumber = list(features.get('tag_pnumber', []))
+        f_holder.feature_tag_capital = list(features.get('tag_capital', []))
+        f_holder.feature_tag_acapital = list(features.get('tag_acapital', []))
+        values = result.values
+        f_holder.feature_money_list = list(values.get('money', []))
+        f_holder.feature_time_list = list(values.get('time', []))
+        f_holder.feature_acronym_list = list(values.get('acronym', []))
+        f_holder.feature_number_list = list(values.get('number', []))
+        f_holder.feature_acapital_list = list(values.get('acapital', []))
+        f_holder.separate_twoworddot_list = list(values.get('twoworddot', []))
+        f_holder.offsets = None if result.offsets is None else list(result.offsets)
+        return f_holder
+
     def print(self):
         print("with features: "+"\n"+" ".join(self.with_feature)+"\n")
         print("without features: "+"\n"+" ".join(self.without_feature))
 
+class TokenizeResult():
+    """
+        Tokens, feature tags and the words exchanged for feature tokens of one string tokenized by a PreTokenizer.
+        The lists are taken over from the FeatureHolder as they are, nothing is copied, and the attributes can't be reassigned.
+        offsets holds the (start, end) in raw_string of every token when they were asked for, otherwise None.
+    """
+    __slots__ = ('raw_string', 'with_feature', 'tokens', 'features', 'values', 'offsets')
+
+    def __init__(self, raw_string, with_feature, tokens, features, values=None, offsets=None):
+        object.__setattr__(self, 'raw_string', raw_string)
+        object.__setattr__(self, 'with_feature', with_feature)
+        object.__setattr__(self, 'tokens', tokens)
+        object.__setattr__(self, 'features', features)
+        object.__setattr__(self, 'values', values if values is not None else {})
+        object.__setattr__(self, 'offsets', offsets)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TokenizeResult is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("TokenizeResult is read-only")
+
+    def __repr__(self):
+        return "TokenizeResult(%r)" % (self.tokens,)
+
+    def __reduce__(self):
+        # __setattr__ is blocked, pickle through the constructor instead
+        return (TokenizeResult, (self.raw_string, self.with_feature, self.tokens, self.features, self.values, self.offsets))
+
+    @property
+    def without_feature(self):
+        return self.tokens
+
+    def copy(self):
+        """
+            A result with copies of the lists of this one, what the cache hands out so callers can't change its entries
+        """
+        return TokenizeResult(self.raw_string,
+                              None if self.with_feature is None else list(self.with_feature),
+                              list(self.tokens),
+                              {name: list(tags) for name, tags in self.features.items()},
+                              {name: list(words) for name, words in self.values.items()},
+                              None if self.offsets is None else list(self.offsets))
+
+    def get_tokens(self):
+        return self.tokens
+
+    def get_features(self):
+        return self.features
+
+    def get_values(self):
+        return self.values
+
+    def get_offsets(self):
+        return self.offsets
+
+    def get_spans(self):
+        """
+            The text of raw_string every token was made from
+        """
+        return [self.raw_string[start:end] for start, end in self.offsets]
+
+    def print(self):
+        print("with features: "+"\n"+" ".join(self.with_feature or [])+"\n")
+        print("without features: "+"\n"+" ".join(self.tokens))
+
+
+class FeatureArrays():
+    """
+        Tokens and feature tags of a batch of strings, the tags stored in NumPy int8 arrays.
+        Unpadded, features maps every name in FEATURE_TAGS to one array of the tags of all strings after each other,
+        the tags of string i are features[name][offsets[i]:offsets[i + 1]].
+        Padded, features maps every name to a (strings, longest string) matrix padded with 0, offsets is None.
+        lengths holds the number of tokens of every string.
+    """
+    __slots__ = ('tokens', 'features', 'lengths', 'offsets')
+
+    def __init__(self, tokens, features, lengths, offsets=None):
+        self.tokens = tokens
+        self.features = features
+        self.lengths = lengths
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def get_tokens(self, i):
+        return self.tokens[i]
+
+    def get_features(self, i):
+        """
+            The tags of string i as views into the batch arrays
+        """
+        if self.offsets is None:
+            length = self.lengths[i]
+            return {name: tags[i, :length] for name, tags in self.features.items()}
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {name: tags[start:end] for name, tags in self.features.items()}
+
+
+_module_digest = None
+
+def _fingerprint(*parts):
+    import hashlib
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8", "surrogatepass"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def _module_fingerprint():
+    """
+        Digest of the source of this module, any edit to the rules or the tokenizer changes it
+    """
+    global _module_digest
+    if _module_digest is None:
+        try:
+            with open(__file__, "rb") as f:
+                source = f.read().decode("utf-8", "surrogateescape")
+        except (OSError, NameError):
+            source = repr(sorted(globals()))
+        _module_digest = _fingerprint(source)
+    return _module_digest
+
+def _class_source(cls):
+    import inspect
+    try:
+        return inspect.getsource(cls)
+    except (OSError, TypeError):
+        return repr(sorted(vars(cls)))
+
+def _rules_fingerprint(rules):
+    """
+        Digest of this module, the rules in order and their configuration.
+        Rule classes defined elsewhere are taken in by their source, as are their bases outside this module.
+    """
+    parts = [_module_fingerprint()]
+    for rule in rules:
+        cls = type(rule)
+        parts.append(cls.__module__ + "." + cls.__qualname__)
+        for base in cls.__mro__:
+            if base.__module__ not in (__name__, "builtins"):
+                parts.append(_class_source(base))
+        parts.append(repr(sorted(vars(rule).items())))
+    return _fingerprint(*parts)
+
+# names of the splitters seen so far, working them out means going through the whole trained model
+_splitter_names = weakref.WeakKeyDictionary()
+
+def _splitter_state(splitter):
+    """
+        The configuration of a splitter as a string, for a punkt model its trained parameters.
+        Sets are sorted so the string is the same in every process.
+    """
+    params = getattr(splitter, "_params", None)
+    if params is not None:
+        return repr((sorted(params.abbrev_types), sorted(params.collocations),
+                     sorted(params.sent_starters), sorted(params.ortho_context.items())))
+    try:
+        return repr(sorted(vars(splitter).items()))
+    except TypeError:
+        return repr(splitter)
+
+def _splitter_name(nltk_tokenizer):
+    """
+        The class of the splitter and a digest of its configuration, a splitter is expected not to be retrained once used
+    """
+    if isinstance(nltk_tokenizer, types.ModuleType):
+        return nltk_tokenizer.__name__
+    try:
+        return _splitter_names[nltk_tokenizer]
+    except (KeyError, TypeError):
+        pass
+    if isinstance(nltk_tokenizer, PunktSentenceSplitter):
+        state = _splitter_state(nltk_tokenizer.load()._tokenizer)
+    else:
+        state = _splitter_state(nltk_tokenizer)
+    cls = type(nltk_tokenizer)
+    name = cls.__module__ + "." + cls.__qualname__ + ":" + _fingerprint(state)
+    try:
+        _splitter_names[nltk_tokenizer] = name
+    except TypeError:
+        pass
+    return name
+
+@functools.lru_cache(maxsize=None)
+def _splitter_fingerprint(splitter_name, use_dialogue, use_quote):
+    return _fingerprint(_module_fingerprint(), "wrapped_nltk_sentence_split", splitter_name, repr((bool(use_dialogue), bool(use_quote))))
+
+
+class ResultCache():
+    """
+        Results of tokenize and wrapped_nltk_sentence_split by input text and a fingerprint of the configuration
+        that produced them, the source of this module, the rules in order and their attributes,
+        or the sentence splitter and its trained parameters.
+        Changing any of them changes the fingerprint, old entries are then never looked up again.
+        The last maxsize results are kept in memory, with path they are also stored in a SQLite file
+        that any number of processes can share. Entries are pickled, only point path at files you trust.
+    """
+    def __init__(self, maxsize=10000, path=None):
+        self.maxsize = maxsize
+        self.path = None if path is None else os.fspath(path)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # entries, locks and connections stay behind, a cache sent to another process starts empty
+        return {'maxsize': self.maxsize, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connection(self):
+        """
+            The SQLite connection of this thread, connections can't be shared between threads or carried over a fork
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            import sqlite3
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _disk_key(fingerprint, text):
+        return _fingerprint(fingerprint, text)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def get(self, fingerprint, text):
+        """
+            The result stored for text under fingerprint, None when there is none
+        """
+        key = (fingerprint, text)
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.path is not None:
+            row = self._connection().execute("SELECT value FROM results WHERE key = ?",
+                                             (self._disk_key(fingerprint, text),)).fetchone()
+            if row is not None:
+                import pickle
+                value = pickle.loads(row[0])
+                self._remember(key, value)
+                with self._lock:
+                    self.disk_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, fingerprint, text, value):
+        self._remember((fingerprint, text), value)
+        if self.path is not None:
+            import pickle
+            self._connection().execute("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)",
+                                       (self._disk_key(fingerprint, text), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def clear(self):
+        """
+            Drop every entry, in memory and on disk
+        """
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.disk_hits = self.misses = 0
+        if self.path is not None:
+            self._connection().execute("DELETE FROM results")
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'size': len(self._memory),
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,}
+
+    def __len__(self):
+        return len(self._memory)
+
+
+class RuleStats():
+    """
+        What one rule cost and did over all profiled strings, lengths are counted in characters
+    """
+    __slots__ = ('name', 'calls', 'seconds', 'chars_in', 'chars_out', 'changed')
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.chars_in = 0
+        self.chars_out = 0
+        self.changed = 0
+
+    def __repr__(self):
+        return "RuleStats(%r, calls=%d, seconds=%.6f, changed=%d)" % (self.name, self.calls, self.seconds, self.changed)
+
+    @property
+    def mean_seconds(self):
+        return self.seconds / self.calls if self.calls else 0.0
+
+    @property
+    def change_rate(self):
+        """
+            The share of calls where the rule changed the text
+        """
+        return self.changed / self.calls if self.calls else 0.0
+
+    def as_dict(self):
+        return {'name': self.name,
+                'calls': self.calls,
+                'seconds': self.seconds,
+                'mean_seconds': self.mean_seconds,
+                'chars_in': self.chars_in,
+                'chars_out': self.chars_out,
+                'changed': self.changed,
+                'change_rate': self.change_rate,}
+
+
+class PipelineProfile():
+    """
+        Per rule statistics collected by PreTokenizer.enable_profiling, one RuleStats per rule name in pipeline order.
+        One profile can be shared by several PreTokenizers and threads, every string is added under a lock at once.
+    """
+    def __init__(self):
+        self.rules = {}
+        self.strings = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'rules': self.rules, 'strings': self.strings}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.rules = state['rules']
+        self.strings = state['strings']
+
+    def __getitem__(self, name):
+        return self.rules[name]
+
+    def __iter__(self):
+        return iter(list(self.rules.values()))
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, samples):
+        """
+            Add the (rule name, seconds, characters in, characters out, changed) of every rule run on one string
+        """
+        with self._lock:
+            self.strings += 1
+            for name, seconds, chars_in, chars_out, changed in samples:
+                stats = self.rules.get(name)
+                if stats is None:
+                    stats = self.rules[name] = RuleStats(name)
+                stats.calls += 1
+                stats.seconds += seconds
+                stats.chars_in += chars_in
+                stats.chars_out += chars_out
+                stats.changed += changed
+
+    def merge(self, other):
+        """
+            Add the statistics of another profile, such as one collected in a worker process
+        """
+        with self._lock:
+            self.strings += other.strings
+            for theirs in other:
+                stats = self.rules.get(theirs.name)
+                if stats is None:
+                    stats = self.rules[theirs.name] = RuleStats(theirs.name)
+                for field in ('calls', 'seconds', 'chars_in', 'chars_out', 'changed'):
+                    setattr(stats, field, getattr(stats, field) + getattr(theirs, field))
+        return self
+
+    def reset(self):
+        with self._lock:
+            self.rules = {}
+            self.strings = 0
+
+    @property
+    def total_seconds(self):
+        return sum(stats.seconds for stats in self.rules.values())
+
+    def as_dicts(self, sort_by=None):
+        """
+            The statistics as one dict per rule, in pipeline order or largest first by the field sort_by
+        """
+        rows = [stats.as_dict() for stats in self]
+        if sort_by is not None:
+            rows.sort(key=lambda row: row[sort_by], reverse=True)
+        return rows
+
+    def report(self, sort_by='seconds'):
+        """
+            The statistics as a text table
+        """
+        total = self.total_seconds or 1.0
+        lines = ["{:<36} {:>9} {:>10} {:>6} {:>10} {:>8}".format("rule", "calls", "seconds", "share", "us/call", "changed")]
+        for row in self.as_dicts(sort_by=sort_by):
+            lines.append("{:<36} {:>9} {:>10.4f} {:>5.1f}% {:>10.2f} {:>7.1f}%".format(
+                         row['name'][:36], row['calls'], row['seconds'], 100 * row['seconds'] / total,
+                         1e6 * row['mean_seconds'], 100 * row['change_rate']))
+        return "\n".join(lines)
+
+
+def _initial_sources(string):
+    """
+        The raw span of every character of string, None for the spaces between words
+    """
+    return [None if char == " " else (p, p + 1) for p, char in enumerate(string)]
+
+def _edit_hunks(edits):
+    """
+        (old start, old end, new start, new end) of the (start, end, replacement) edits one substitution made
+    """
+    hunks = []
+    delta = 0
+    for start, end, text in edits:
+        hunks.append((start, end, start + delta, start + delta + len(text)))
+        delta += len(text) - (end - start)
+    return hunks
+
+def _find_sync(old_words, new_words, i, j, window=16):
+    """
+        The nearest (i2, j2) after a mismatch at (i, j) where the words line up again, looking at most window words
+        ahead in each list. A match whose next words differ as well counts as three words further away,
+        of two matches as far away the one whose next words match wins.
+    """
+    n_old = len(old_words)
+    n_new = len(new_words)
+    best = None
+    best_distance = window * 2 + 1
+    if n_old - i <= window and n_new - j <= window:
+        best = (n_old, n_new)
+        best_distance = n_old - i + n_new - j
+    positions = {}
+    for j2 in range(j, min(j + window + 1, n_new)):
+        positions.setdefault(new_words[j2], []).append(j2)
+    for i2 in range(i, min(i + window + 1, n_old)):
+        if i2 - i >= best_distance:
+            break
+        for j2 in positions.get(old_words[i2], ()):
+            confirmed = ((i2 + 1 == n_old and j2 + 1 == n_new)
+                         or (i2 + 1 < n_old and j2 + 1 < n_new and old_words[i2 + 1] == new_words[j2 + 1]))
+            distance = i2 - i + j2 - j + (0 if confirmed else 3)
+            if distance < best_distance or (distance == best_distance and confirmed and best != (n_old, n_new)):
+                best = (i2, j2)
+                best_distance = distance
+    return best
+
+def _diff_words(old_text, new_text):
+    """
+        (old start, old end, new start, new end, equal) of the words two texts have in common and of the runs of words
+        in between that a rule replaced, found in one pass over the words. Runs of spaces are not words.
+    """
+    def words(text):
+        found = []
+        starts = []
+        start = 0
+        for word in text.split(" "):
+            if word:
+                found.append(word)
+                starts.append(start)
+            start += len(word) + 1
+        return found, starts
+    old_words, old_starts = words(old_text)
+    new_words, new_starts = words(new_text)
+    n_old = len(old_words)
+    n_new = len(new_words)
+    blocks = []
+    i = j = 0
+    while i < n_old or j < n_new:
+        if i < n_old and j < n_new and old_words[i] == new_words[j]:
+            blocks.append((old_starts[i], old_starts[i] + len(old_words[i]), new_starts[j], new_starts[j] + len(new_words[j]), True))
+            i += 1
+            j += 1
+            continue
+        sync = _find_sync(old_words, new_words, i, j) if i < n_old and j < n_new else None
+        if sync is not None:
+            i2, j2 = sync
+        elif i < n_old and j < n_new:
+            # nothing lines up nearby, take the words one for one
+            i2, j2 = i + 1, j + 1
+        else:
+            i2, j2 = n_old, n_new
+        o1 = old_starts[i] if i < n_old else len(old_text)
+        o2 = old_starts[i2 - 1] + len(old_words[i2 - 1]) if i2 > i else o1
+        n1 = new_starts[j] if j < n_new else len(new_text)
+        n2 = new_starts[j2 - 1] + len(new_words[j2 - 1]) if j2 > j else n1
+        blocks.append((o1, o2, n1, n2, False))
+        i, j = i2, j2
+    return blocks
+
+def _source_groups(text, sources, start, end):
+    """
+        sources[start:end] split into one list per word of text[start:end]
+    """
+    groups = []
+    group = []
+    for k in range(start, end):
+        if text[k].isspace():
+            if group:
+                groups.append(group)
+                group = []
+        elif sources[k] is not None:
+            group.append(sources[k])
+    if group:
+        groups.append(group)
+    return groups
+
+def _rewrite_region(old_text, old_sources, i, i2, new_text, new_sources, j, j2, attached, first, last, intact):
+    """
+        Give new_text[j:j2], which a rule wrote in place of old_text[i:i2], raw spans. As many characters as were
+        replaced get their spans one for one. Otherwise whole words get the span of the characters they replaced
+        and parts of words the union of the spans of the old words they were part of within old_text[first:last],
+        so won't -> will not gives both words the span of won't. intact maps the positions of characters the rule kept
+        as a word of their own to that word. The union takes in at most one such word on either side, so
+        Senioryou'll -> Senior you will gives will the span of you'll and not of Senioryou'll.
+        Characters removed from inside a word are added to attached as (position, span) for the character next to them.
+    """
+    replaced = [source for source in old_sources[i:i2] if source is not None]
+    positions = [k for k in range(j, j2) if new_text[k] != " "]
+    if replaced and len(replaced) == len(positions):
+        for k, source in zip(positions, replaced):
+            new_sources[k] = source
+        return
+    if j == j2:
+        # characters were only removed, a word they were removed from keeps them in its span
+        if replaced:
+            span = (min(replaced)[0], max(end for _, end in replaced))
+            if 0 < j <= len(new_text) and not new_text[j - 1].isspace() and i > 0 and not old_text[i - 1].isspace():
+                attached.append((j - 1, span))
+            elif j2 < len(new_text) and not new_text[j2].isspace() and i2 < len(old_text) and not old_text[i2].isspace():
+                attached.append((j2, span))
+        return
+    whole_words = (j == 0 or new_text[j - 1].isspace()) and (j2 == len(new_text) or new_text[j2].isspace())
+    if whole_words:
+        # as many words as were replaced, 5 6 -> #NUMBER# #NUMBER#, get their spans one for one
+        old_words = _source_groups(old_text, old_sources, i, i2)
+        new_words = _source_groups(new_text, range(len(new_text)), j, j2)
+        if len(old_words) == len(new_words) > 1:
+            for old_word, new_word in zip(old_words, new_words):
+                span = (min(old_word)[0], max(end for _, end in old_word))
+                for k in new_word:
+                    new_sources[k] = span
+            return
+    else:
+        start, end = i, i2
+        word = None
+        while start > first and not old_text[start - 1].isspace():
+            if start - 1 in intact:
+                if word is not None and intact[start - 1] != word:
+                    break
+                word = intact[start - 1]
+            start -= 1
+        word = None
+        while end < last and not old_text[end].isspace():
+            if end in intact:
+                if word is not None and intact[end] != word:
+                    break
+                word = intact[end]
+            end += 1
+        replaced = [source for source in old_sources[start:end] if source is not None]
+    if replaced:
+        span = (min(replaced)[0], max(end for _, end in replaced))
+    else:
+        # words added from nothing get an empty span where they were added
+        k = i - 1
+        while k >= 0 and old_sources[k] is None:
+            k -= 1
+        position = old_sources[k][1] if k >= 0 else 0
+        span = (position, position)
+    for k in positions:
+        new_sources[k] = span
+
+def _rewrite_hunk(old_text, old_sources, o1, o2, new_text, new_sources, n1, n2, attached):
+    """
+        Fill new_sources[n1:n2] for new_text[n1:n2], which a rule made out of old_text[o1:o2].
+        The characters apart from spaces are lined up, the ones both sides have keep their spans and every run of
+        characters in between is rewritten by _rewrite_region. Hunks are a few words, longer ones only have the
+        characters they start and end with lined up.
+    """
+    old_positions = [k for k in range(o1, o2) if old_text[k] != " "]
+    new_positions = [k for k in range(n1, n2) if new_text[k] != " "]
+    old_chars = "".join([old_text[k] for k in old_positions])
+    new_chars = "".join([new_text[k] for k in new_positions])
+    n_old = len(old_chars)
+    n_new = len(new_chars)
+    first = 0
+    while first < n_old and first < n_new and old_chars[first] == new_chars[first]:
+        first += 1
+    last = 0
+    while last < n_old - first and last < n_new - first and old_chars[n_old - 1 - last] == new_chars[n_new - 1 - last]:
+        last += 1
+    opcodes = [('equal', 0, first, 0, first)]
+    if first < n_old - last and first < n_new - last and n_old <= 200 and n_new <= 200:
+        import difflib
+        matcher = difflib.SequenceMatcher(None, old_chars[first:n_old - last], new_chars[first:n_new - last], autojunk=False)
+        opcodes.extend((tag, first + i1, first + i2, first + j1, first + j2) for tag, i1, i2, j1, j2 in matcher.get_opcodes())
+    elif first < n_old - last or first < n_new - last:
+        opcodes.append(('replace', first, n_old - last, first, n_new - last))
+    opcodes.append(('equal', n_old - last, n_old, n_new - last, n_new))
+
+    # old positions of the characters of new words made only of kept characters, with the start of that word
+    kept = {}
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            for k in range(i2 - i1):
+                kept[new_positions[j1 + k]] = old_positions[i1 + k]
+    intact = {}
+    word = []
+    for k in range(n1, n2 + 1):
+        if k < n2 and not new_text[k].isspace():
+            word.append(k)
+            continue
+        if word and all(position in kept for position in word):
+            intact.update((kept[position], word[0]) for position in word)
+        word = []
+
+    regions = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            for k in range(i2 - i1):
+                new_sources[new_positions[j1 + k]] = old_sources[old_positions[i1 + k]]
+            continue
+        if i1 < i2:
+            i, i_end = old_positions[i1], old_positions[i2 - 1] + 1
+        else:
+            i = i_end = old_positions[i1 - 1] + 1 if i1 else o1
+        if j1 < j2:
+            j, j_end = new_positions[j1], new_positions[j2 - 1] + 1
+        else:
+            j = j_end = new_positions[j1 - 1] + 1 if j1 else n1
+        blank = (not old_text[i:i_end] or old_text[i:i_end].isspace()) and (not new_text[j:j_end] or new_text[j:j_end].isspace())
+        # changes inside the same old word that end up in the same new word are one rewrite of that word,
+        # won't -> will not is not w -> will, while "Hello" -> #LDQ# Hello #RDQ# leaves Hello its own span
+        if (regions and not blank and not regions[-1][4] and not any(char.isspace() for char in old_text[regions[-1][1]:i])
+                and not any(char.isspace() for char in new_text[regions[-1][3]:j])):
+            regions[-1] = (regions[-1][0], i_end, regions[-1][2], j_end, False)
+        else:
+            regions.append((i, i_end, j, j_end, blank))
+    for i, i_end, j, j_end, blank in regions:
+        if not blank:
+            _rewrite_region(old_text, old_sources, i, i_end, new_text, new_sources, j, j_end, attached, o1, o2, intact)
+            continue
+        # line breaks and tabs turned into spaces or back only separate words, they don't belong to any
+        span = next((source for source in old_sources[i:i_end] if source is not None), None)
+        for k in range(j, j_end):
+            if new_text[k] != " ":
+                new_sources[k] = span if span is not None else (0, 0)
+
+def _carry_sources(old_text, new_text, old_sources, steps):
+    """
+        The raw spans of the characters of new_text, the text after a rule, from those of old_text, the text before it.
+        steps holds (before, after, edits) of every substitution the rule made, when they lead from old_text to new_text
+        the edits are followed exactly, otherwise the words of the two texts are lined up.
+    """
+    if not (steps and steps[0][0] == old_text and steps[-1][1] == new_text
+            and all(previous[1] == step[0] for previous, step in zip(steps, steps[1:]))):
+        new_sources = [None] * len(new_text)
+        attached = []
+        for o1, o2, n1, n2, equal in _diff_words(old_text, new_text):
+            if equal:
+                new_sources[n1:n2] = old_sources[o1:o2]
+            else:
+                _rewrite_hunk(old_text, old_sources, o1, o2, new_text, new_sources, n1, n2, attached)
+        return _attach(new_sources, attached)
+
+    sources = old_sources
+    for before, after, edits in steps:
+        new_sources = [None] * len(after)
+        attached = []
+        o_end = n_end = 0
+        for o1, o2, n1, n2 in _edit_hunks(edits):
+            # the text between two edits is the same on both sides
+            new_sources[n_end:n1] = sources[o_end:o1]
+            _rewrite_hunk(before, sources, o1, o2, after, new_sources, n1, n2, attached)
+            o_end, n_end = o2, n2
+        new_sources[n_end:] = sources[o_end:]
+        sources = _attach(new_sources, attached)
+    return sources
+
+def _attach(sources, attached):
+    for position, (start, end) in attached:
+        source = sources[position]
+        if source is not None:
+            sources[position] = (min(start, source[0]), max(end, source[1]))
+    return sources
+
+def _token_spans(text, sources):
+    """
+        (start, end) in the raw string of every word of text, empty words get an empty span after the word before them
+    """
+    spans = []
+    position = 0
+    start = 0
+    for word in text.split(" "):
+        end = start + len(word)
+        if word:
+            word_sources = sources[start:end]
+            position = max(source_end for _, source_end in word_sources)
+            spans.append((min(word_sources)[0], position))
+        else:
+            spans.append((position, position))
+        start = end + 1
+    return spans
+
+
+class CompiledPipeline():
+    """
+        The sorted rules of a PreTokenizer with all their regular expressions compiled.
+        The patterns are compiled once per rule class and shared, the steps are the methods of the rule
+        instances of one PreTokenizer so every PreTokenizer keeps the configuration of its own rules.
+    """
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        self._fingerprint = None
+        # the attributes of the rules when the pipeline was built, the fingerprint is only valid while they stay the same
+        self._state = [copy.deepcopy(vars(rule)) for rule in self.rules]
+        for rule in self.rules:
+            rule.compile()
+        self._rule_steps = tuple((rule._takes_tokens, rule.use_tokens if rule._takes_tokens else rule.use) for rule in self.rules)
+        # consecutive word level rules become one step that loops over the words once
+        steps = []
+        for is_word_level, group in itertools.groupby(self.rules, key=lambda rule: rule._word_level):
+            group = list(group)
+            if is_word_level and len(group) > 1:
+                uses = tuple(rule.use_word for rule in group)
+                steps.append((True, lambda f_holder, tokens, uses=uses: (f_holder, _transform_words(f_holder, tokens, uses))))
+            else:
+                steps.extend((rule._takes_tokens, rule.use_tokens if rule._takes_tokens else rule.use) for rule in group)
+        self._steps = tuple(steps)
+
+    @property
+    def fingerprint(self):
+        """
+            Digest of the module source and the rules of the pipeline, the key ResultCache stores results under
+        """
+        if self._fingerprint is None:
+            self._fingerprint = _rules_fingerprint(self.rules)
+        return self._fingerprint
+
+    def is_current(self, rules):
+        """
+            Whether the pipeline was built from rules as they are now, the same instances in the same order with the same attributes
+        """
+        return self.rules == tuple(rules) and [vars(rule) for rule in self.rules] == self._state
+
+    def run(self, f_holder, string, step_wise=False, profile=None):
+        """
+            Run all rules on string, rules that take tokens get the string split on " " and the
+            tokens are only joined back when a rule that takes a string comes next
+        """
+        if profile is not None:
+            f_holder, value, _ = self._run_unfused(f_holder, string, profile=profile)
+            return f_holder, value
+        value = string
+        # run rule by rule when printing the steps, fused steps have no value in between
+        for i, (takes_tokens, use) in enumerate(self._rule_steps if step_wise else self._steps):
+            if takes_tokens:
+                if isinstance(value, str):
+                    value = value.split(" ")
+            elif not isinstance(value, str):
+                value = " ".join(value)
+            f_holder, value = use(f_holder, value)
+            assert f_holder is not None
+            assert value is not None
+            if step_wise:
+                print(self.rules[i]._name)
+                print(value if isinstance(value, str) else " ".join(value))
+        if not isinstance(value, str):
+            value = " ".join(value)
+        return f_holder, value
+
+    def run_with_offsets(self, f_holder, string, profile=None):
+        """
+            Run all rules on string and also return the (start, end) in string of every word of the result.
+            The span of every character is carried from rule to rule, following the edits of substitute() where there are any
+            and lining up the words before and after the rule otherwise, both in one pass over the string.
+        """
+        return self._run_unfused(f_holder, string, profile=profile, track_spans=True)
+
+    def _run_unfused(self, f_holder, string, profile=None, track_spans=False):
+        """
+            Run the rules one by one, with a profile timing every rule and comparing the text before and after it,
+            with track_spans carrying the spans of the words through every rule
+        """
+        perf_counter = time.perf_counter
+        samples = []
+        value = string
+        text = string
+        sources = _initial_sources(string) if track_spans else None
+        for rule, (takes_tokens, use) in zip(self.rules, self._rule_steps):
+            if takes_tokens:
+                if isinstance(value, str):
+                    value = value.split(" ")
+            elif not isinstance(value, str):
+                value = " ".join(value)
+            start = perf_counter()
+            if track_spans:
+                _substitution_log.steps = steps = []
+                try:
+                    f_holder, value = use(f_holder, value)
+                finally:
+                    _substitution_log.steps = None
+            else:
+                f_holder, value = use(f_holder, value)
+            seconds = perf_counter() - start
+            assert f_holder is not None
+            assert value is not None
+            # token rules may change their list in place, compare the joined text
+            new_text = value if isinstance(value, str) else " ".join(value)
+            if profile is not None:
+                samples.append((rule._name, seconds, len(text), len(new_text), new_text != text))
+            if track_spans and new_text != text:
+                sources = _carry_sources(text, new_text, sources, steps)
+            text = new_text
+        if profile is not None:
+            profile.add(samples)
+        return f_holder, text, _token_spans(text, sources) if track_spans else None
+
+
 class PreTokenizer():
-    def __init__(self, rules=None):
+    """
+        Runs the rules in their order on a string. cache can be a ResultCache, tokenize and tokenize_batch
+        then return the stored result for strings tokenized before with the same rules.
+    """
+    def __init__(self, rules=None, cache=None):
         self.rules = rules if rules else []
         self.rules.sort(key=lambda x: x._order)
         self.f_holder = FeatureHolder()
+        self.pipeline = None
+        self.cache = cache
+        self.profile = None
 
-    def tokenize(self, string, step_wise=False, bundle=True):
-        self.f_holder.reset()
-        self.f_holder.set_raw_string(string)
-        for rule in self.rules:
-            self.f_holder, string = rule.use(self.f_holder, string)
-            assert self.f_holder is not None
-            assert string is not None
-            if step_wise:
-                print(rule._name)
-                print(string)
+    def compile(self):
+        """
+            Resolve the rules into a compiled pipeline, the regular expressions of every rule class are only compiled once.
+            The tokenize methods call it again by themselves when self.rules or an attribute of a rule has changed since.
+        """
+        pipeline = CompiledPipeline(self.rules)
+        self.pipeline = pipeline
+        return pipeline
 
-        if not bundle:
-            self.f_holder.without_feature = string.split(" ")
-            return copy.deepcopy(self.f_holder)
+    def _get_pipeline(self):
+        """
+            The compiled pipeline of the current self.rules, compiled again when a rule was added, removed or reconfigured
+        """
+        pipeline = self.pipeline
+        if pipeline is None or not pipeline.is_current(self.rules):
+            pipeline = self.compile()
+        return pipeline
+
+    def enable_profiling(self, profile=None):
+        """
+            Collect per rule statistics into profile, a new PipelineProfile by default, and return it.
+            Profiled strings run the rules one by one instead of fused, which makes them somewhat slower.
+            Strings answered from the cache run no rules and are not counted.
+        """
+        self.profile = profile if profile is not None else PipelineProfile()
+        return self.profile
+
+    def disable_profiling(self):
+        """
+            Stop collecting statistics and return the profile collected so far
+        """
+        profile, self.profile = self.profile, None
+        return profile
 
-        bundle_worked = self.f_holder.bundle_lists(string)
-        if not bundle_worked:
-            print("bundling did not work for some reason")
+    def tokenize(self, string, step_wise=False, bundle=True, offsets=False):
+        """
+            Tokenize string with a FeatureHolder of its own and return the outcome as a TokenizeResult,
+            nothing is shared between calls so one PreTokenizer can be used from several threads at once.
+            The FeatureHolder of the last call is also kept in self.f_holder for get_tokens() and get_fholder().
+            With offsets the result also holds the (start, end) in string of every token, the rules then run
+            one by one and step_wise is ignored.
+        """
+        pipeline = self._get_pipeline()
+        # step_wise is for looking at the rules, always run them
+        cache = self.cache if not step_wise or offsets else None
+        if cache is not None:
+            fingerprint = pipeline.fingerprint if bundle else pipeline.fingerprint + ":unbundled"
+            if offsets:
+                fingerprint += ":offsets"
+            result = cache.get(fingerprint, string)
+            if result is not None:
+                self.f_holder = FeatureHolder.from_result(result)
+                return result.copy()
+
+        raw_string = string
+        f_holder = FeatureHolder()
+        f_holder.set_raw_string(string)
+        if offsets:
+            f_holder, string, f_holder.offsets = pipeline.run_with_offsets(f_holder, string, profile=self.profile)
+        else:
+            f_holder, string = pipeline.run(f_holder, string, step_wise=step_wise, profile=None if step_wise else self.profile)
+        self.f_holder = f_holder
+
+        if not bundle:
+            f_holder.without_feature = string.split(" ")
+            result = f_holder.get_result()
+            if cache is not None:
+                cache.put(fingerprint, raw_string, result.copy())
+            return result
+
+        bundle_worked = f_holder.bundle_lists(string)
+        if not bundle_worked and _diagnostics is not None:
+            _diagnostics.record("tokenize.bundling_failed", raw_string)
+        result = f_holder.get_result()
+        if cache is not None and bundle_worked:
+            cache.put(fingerprint, raw_string, result.copy())
+        return result
+
+    def tokenize_batch(self, strings, offsets=False):
+        """
+            Tokenize every string in strings and return one TokenizeResult per string.
+            The compiled pipeline is looked up and a FeatureHolder is created once for the whole batch,
+            reset and bundle_lists build new lists for every string so the results need no copying.
+            With offsets every result holds the (start, end) in its string of every token.
+        """
+        pipeline = self._get_pipeline()
+        run = pipeline.run
+        cache = self.cache
+        fingerprint = None
+        if cache is not None:
+            fingerprint = pipeline.fingerprint + ":offsets" if offsets else pipeline.fingerprint
+        f_holder = FeatureHolder()
+        last_holder = f_holder
+        results = []
+        for string in strings:
+            if cache is not None:
+                result = cache.get(fingerprint, string)
+                if result is not None:
+                    results.append(result.copy())
+                    last_holder = None
+                    continue
+            f_holder.reset()
+            f_holder.set_raw_string(string)
+            if offsets:
+                f_holder, tokenized, f_holder.offsets = pipeline.run_with_offsets(f_holder, string, profile=self.profile)
+            else:
+                f_holder, tokenized = run(f_holder, string, profile=self.profile)
+            bundle_worked = f_holder.bundle_lists(tokenized)
+            if not bundle_worked and _diagnostics is not None:
+                _diagnostics.record("tokenize.bundling_failed", string)
+            result = f_holder.get_result()
+            if cache is not None and bundle_worked:
+                cache.put(fingerprint, string, result.copy())
+            results.append(result)
+            last_holder = f_holder
+        self.f_holder = last_holder if last_holder is not None else FeatureHolder.from_result(results[-1])
+        return results
+
+    def tokenize_batch_arrays(self, strings, padded=False):
+        """
+            Tokenize every string in strings and return a FeatureArrays with the feature tags in NumPy int8 arrays.
+            The rules are run on every string first, then the arrays are allocated once for the whole batch
+            and bundle_lists writes the tags straight into them. Needs numpy.
+        """
+        import numpy as np
+        run = self._get_pipeline().run
+        holders = []
+        tokenized = []
+        for string in strings:
+            f_holder = FeatureHolder()
+            f_holder.set_raw_string(string)
+            f_holder, string = run(f_holder, string, profile=self.profile)
+            holders.append(f_holder)
+            tokenized.append(string)
+
+        lengths = np.fromiter((string.count(" ") + 1 for string in tokenized), dtype=np.int64, count=len(tokenized))
+        if padded:
+            width = int(lengths.max()) if len(tokenized) else 0
+            tags = np.zeros((len(FEATURE_TAGS), len(tokenized), width), dtype=np.int8)
+            offsets = None
+        else:
+            offsets = np.zeros(len(tokenized) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            tags = np.zeros((len(FEATURE_TAGS), int(offsets[-1])), dtype=np.int8)
+
+        tokens = []
+        for i, (f_holder, string) in enumerate(zip(holders, tokenized)):
+            if padded:
+                string_tags = tags[:, i, :lengths[i]]
+            else:
+                string_tags = tags[:, offsets[i]:offsets[i + 1]]
+            if not f_holder.bundle_lists(string, tags=string_tags) and _diagnostics is not None:
+                _diagnostics.record("tokenize.bundling_failed", f_holder.raw_string)
+            tokens.append(f_holder.without_feature)
+        if holders:
+            self.f_holder = holders[-1]
+        return FeatureArrays(tokens, dict(zip(FEATURE_TAGS, tags)), lengths, offsets)
 
     def get_tokens(self):
         return self.f_holder.get_tokens()
 
+    def get_offsets(self):
+        """
+            (start, end) of every token of the last string, None unless it was tokenized with offsets
+        """
+        return self.f_holder.get_offsets()
+
     def get_fholder(self):
-        return copy.deepcopy(self.f_holder)
+        """
+            A FeatureHolder with the tokens and features of the last tokenized string, for before_spacy and after_spacy.
+            It owns copies of the lists, the TokenizeResult returned by tokenize is left as it is.
+        """
+        return self.f_holder.copy()
 
     def get_tokens_as_string(self):
         return " ".join(self.f_holder.get_tokens())
@@ -573,14 +2054,13 @@ class PreTokenizer():
     #
     #     return feature_holders
 
-def make_new_pretokenizer():
-    return PreTokenizer([
+def make_new_pretokenizer(cache=None):
+    return PreTokenizer(cache=cache, rules=[
                         pad_whitespace_rule(),
                         remove_words_inside_clamps(),
                         classless_feature_rule(),
                         change_capital_words_with_dot(),
                         remove_bad_characters(),
-                        remove_unicode_characters(),
                         remove_simple_misstakes(),
                         three_dot_rule(),
                         UNILM_to_standard(),
@@ -591,13 +2071,12 @@ def make_new_pretokenizer():
                         brackets_rule(),
                         slash_rule(),
                         feature_time_rule(),
-                        normalize_dash_rule(),
                         feature_tag_acapital_rule(),
                         feature_common_shortening_rule(),
                         end_accent_rule(),
                         feature_tag_acronym_rule(),
                         space_dot_rule(),
-                        pre_quote_rule(),
+                        normalize_characters_rule(),
                         quote_rule(),
                         currency_rule(),
                         pre_number_rule(),
@@ -608,8 +2087,46 @@ def make_new_pretokenizer():
                         split_colon_rule(),
                         ])
 
+def iter_paragraphs(lines, by_line=False):
+    """
+        Yield the paragraphs of an iterable of lines, paragraphs are separated by blank lines
+        (or every line is a paragraph when by_line is True). Only one paragraph is held in memory.
+    """
+    paragraph = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            if paragraph:
+                yield "\n".join(paragraph)
+                paragraph = []
+        elif by_line:
+            yield line
+        else:
+            paragraph.append(line)
+    if paragraph:
+        yield "\n".join(paragraph)
+
+def iter_tokenize(source, pretokenizer=None, nltk_tokenizer=None, by_line=False, use_dialogue=False, use_quote=False):
+    """
+        Lazily split paragraphs into sentences and tokenize them, yields one TokenizeResult per sentence.
+        source is a path, an open text file or any iterable of lines, it is read one paragraph at a time
+        so memory is bounded by the largest paragraph and not by the size of the file.
+    """
+    if pretokenizer is None:
+        pretokenizer = make_new_pretokenizer()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8") as f:
+            yield from iter_tokenize(f, pretokenizer, nltk_tokenizer, by_line, use_dialogue, use_quote)
+        return
+    for paragraph in iter_paragraphs(source, by_line=by_line):
+        sentences = wrapped_nltk_sentence_split(nltk_tokenizer=nltk_tokenizer, paragraph=paragraph,
+                                                use_dialogue=use_dialogue, use_quote=use_quote)
+        yield from pretokenizer.tokenize_batch(sentences)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
 def single_whitespace(s):
-    return re.sub(r'\s+', r" ", s)
+    return _WHITESPACE_RE.sub(r" ", s)
 
 
 ### NEW STRUCTURE:
@@ -648,50 +2165,57 @@ class classless_feature_rule(TokenizeRule):
     _order = 1
     _name = "classless_feature_rule"
     _description = "some categories I don't have time to fix, I will replace them with a single word instead"
+    _substitutions = [(r"\d+[°]\s?\d+[′]\s?\d+([.]\d+)?[″]\s?[NWSE]", r"coordinate")]
+
     def use(self, f_holder, s):
-        s = re.sub(r"\d+[°]\s?\d+[′]\s?\d+([.]\d+)?[″]\s?[NWSE]", r"coordinate", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class remove_words_inside_clamps(TokenizeRule):
     _order = 3
     _name = "remove_words_inside_clamps"
     _desription = "turn [ and ] into ( )"
+    _substitutions = [(r"\[(.*?)\]", r"(\1)"),
+                      (r"\[", r"("),
+                      (r"\]", r")")]
+
     def use(self, f_holder, s):
-        s = re.sub(r"\[(.*?)\]", r"(\1)", s)
-        s = re.sub(r"\[", r"(", s)
-        s = re.sub(r"\]", r")", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class whitespace_special_character_rule(TokenizeRule):
     _order = 4
     _name = "whitespace_special_character_rule"
     _desription = "put whitespace between between all %, ;, ?, !, #, = "
+    # turn !.. ?.. into ! ... and ? ... etc
+    _substitutions = [(r"([!?])[.][.]", r" \1 ... "),
+                      (r"([%]|[;]|[¡]|[#]|[=]|[>]|[<]|[~]|[_]|[§])", r" \1 "),
+                      (r"(?!([?]|[!])\")([?]|[!])", r" \1 "),
+                      (r"([?]|[!])([\"])", r" \1\2")]
 
     def use(self, f_holder, s):
-        # turn !.. ?.. into ! ... and ? ... etc
-        s = re.sub(r"([!?])[.][.]", r" \1 ... ", s)
-        s = re.sub(r"([%]|[;]|[¡]|[#]|[=]|[>]|[<]|[~]|[_]|[§])", r" \1 ", s)
-        s = re.sub(r"(?!([?]|[!])\")([?]|[!])", r" \1 ", s)
-        s = re.sub(r"([?]|[!])([\"])", r" \1\2", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class brackets_rule(TokenizeRule):
     _order = 5
     _name = "brackets_rule"
     _description = "put whitespace between all '[', ']', '(', ')', '{', '}'"
+    _substitutions = [(r'([\[\]\(\)\{\}])', r' \1 ')]
 
     def use(self, f_holder, s):
-        return f_holder, single_whitespace(re.sub(r'([\[\]\(\)\{\}])', r' \1 ', s))
+        return f_holder, single_whitespace(self.substitute(s))
 
 class normalize_dash_rule(TokenizeRule):
     _name = "normalize_dash_rule"
     _order = 6
     _description = "there are multiple versions of dashes, turn them all into tokens"
+    _substitutions = [(r'--', ' ' + LDASH + ' '),
+                      CharacterMap({'—': ' ' + LDASH + ' ',
+                                    '|': ' ' + LDASH + ' ',
+                                    '–': ' ' + LDASH + ' ',
+                                    '−': ' ' + LDASH + ' ',
+                                    '-': ' ' + DASH + ' '})]
 
     def use(self, f_holder, s):
-        s = re.sub(r'[—|–|−|—]|--', ' ' + self.LDASH + ' ', s)
-        s = re.sub(r'-', ' ' + self.DASH + ' ', s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 
 
@@ -699,148 +2223,187 @@ class pre_quote_rule(TokenizeRule):
     _order = 7
     _name = "pre_quote_rule"
     _description = """unify all versions of quotes: `` to ", '' to " etc."""
+    _substitutions = [(r"(``)|('')", r'"'),
+                      # single quotes between special characters and capital letters,
+                      # before the quotes are unified so the quotes that become ' are matched as well
+                      (r"([.][\'`’‘´])([A-Z])", r"\1 \2"),
+                      CharacterMap({'“': '"',
+                                    '”': '"',
+                                    '`': "'",
+                                    '’': "'",
+                                    '‘': "'",
+                                    '´': "'"})]
+
     def use(self, f_holder, s):
-        s = re.sub(r"(``)|('')|[“]|[”]", r'"', s)
-        s = re.sub(r"[`’‘´]", r"'", s)
-        # single quotes between special characters and capital letters
-        s = re.sub(r"([.]\')([A-Z])", r"\1 \2", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class remove_unicode_characters(TokenizeRule):
     _order = 8
     _name = "remove_unicode_characters"
     _description = "remove specified unicode characters"
+    # all non-ASCII characters are removed, which covers \u030d, \u00c2, \u00bb, \u00e2, \u20ac and \u00b2
+    _substitutions = [CharacterMap({}, drop_non_ascii=True)]
+
     def use(self, f_holder, s):
-        encoded_string = s.encode("ascii", "ignore")
-        s = encoded_string.decode()
-        s = s.replace(u'\u030d', '')
-        s = s.replace(u'\u00c2', '')
-        s = s.replace(u'\u00bb', '')
-        s = s.replace(u'\u00e2', '')
-        s = s.replace(u'\u20ac', '')
-        s = s.replace(u'\u00b2', '')
-        return f_holder, s
+        return f_holder, self.substitute(s)
+
+class normalize_characters_rule(TokenizeRule):
+    _order = 6
+    _name = "normalize_characters_rule"
+    _description = "normalize_dash_rule, pre_quote_rule and remove_unicode_characters in one step"
+    # the multi-character patterns of the three rules first, then one map for the dashes and quotes that also
+    # drops every other non-ASCII character, none of the patterns can match across what the map changes
+    _substitutions = [*normalize_dash_rule._substitutions[:-1],
+                      *pre_quote_rule._substitutions[:-1],
+                      CharacterMap({**normalize_dash_rule._substitutions[-1].mapping,
+                                    **pre_quote_rule._substitutions[-1].mapping}, drop_non_ascii=True)]
+
+    def use(self, f_holder, s):
+        return f_holder, self.substitute(s)
 
 class comma_rule(TokenizeRule):
     _order = 9
     _name = "comma_rule"
     _description = "split ., and , attached to a letter"
+    _substitutions = [(r',([^\s\d]+)', r' , \1'),
+                      (r',([^\s\d]+)', r' , \1'),
+                      (r',([^\s\d]+)', r' , \1'),
+                      (r',([^\s\d]+)', r' , \1'),
+                      (r'([^\s]+), ', r'\1 , '),
+                      (r'[.][,]', r". ,"),
+                      # also split , that is attached to numbers and other characters
+                      (r'(\d)[,]([^\d\s]+[\S]*) ', r"\1 , \2 ")]
 
     def use(self, f_holder, s):
-        s = re.sub(r',([^\s\d]+)', r' , \1', s)
-        s = re.sub(r',([^\s\d]+)', r' , \1', s)
-        s = re.sub(r',([^\s\d]+)', r' , \1', s)
-        s = re.sub(r',([^\s\d]+)', r' , \1', s)
-        s = re.sub(r'([^\s]+), ', r'\1 , ', s)
-        s = re.sub(r'[.][,]', r". ,", s)
-        # also split , that is attached to numbers and other characters
-        s = re.sub(r'(\d)[,]([^\d\s]+[\S]*) ', r"\1 , \2 ", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 
 class feature_time_rule(TokenizeRule):
     _order = 10
     _name = "feature_time_rule"
     _desription = "classify time and split : after finding time"
-
-    def use(self, f_holder, s):
-        # split dot from end of numbers
-        s = re.sub(r"([\d]+)[.] ", r"\1 . ", s)
-        s = s.split(" ")
+    _takes_tokens = True
+    _patterns = {'_time_re': r"(\d+[:]\d+)(.*)",
+                 '_colon_re': r":"}
+
+    def use_tokens(self, f_holder, tokens):
+        # split dot from end of numbers, unless the number is the last word
+        s = []
+        last = len(tokens) - 1
+        for i, word in enumerate(tokens):
+            if i < last and word[-1:] == "." and word[-2:-1].isdecimal():
+                s += [word[:-1], "."]
+            else:
+                s.append(word)
         for i, word in enumerate(s):
-            match = re.match(r"(\d+[:]\d+)(.*)", word)
-            if match:
-                if len(match.groups()) > 1:
-                    s[i] = self.TIME + " " + match.groups()[-1]
-                    f_holder.feature_time_list.append("".join(list(match.groups()[:-1])))
-                else:
-                    s[i] = self.TIME + match.group
-                    f_holder.feature_time_list.append(word)
+            # times have a colon in them
+            if ':' in word:
+                shape = self._time_shape(word)
+                if shape is not None:
+                    time, rest = shape
+                    s[i] = self.TIME + " " + rest
+                    f_holder.feature_time_list.append(time)
         s = " ".join(s)
-        s = re.sub(r":", " : ", s)
+        s = self._colon_re.sub(" : ", s)
         return f_holder, s
 
+    @classmethod
+    @word_shape_cache
+    def _time_shape(cls, word):
+        """
+            The time word starts with and the rest of word after it, None if word is not a time
+        """
+        match = cls._time_re.match(word)
+        if match:
+            return match.groups()
+        return None
+
 class change_capital_words_with_dot(TokenizeRule):
     _order = 11
     _name = "change_capital_words_with_dot"
     _description = "some words e.g. CMD. should be turned into Cmd."
+    # im is split by spacy to i m, don't want this
+    _substitutions = [(re.escape(r" im "), r" em "),
+                      (re.escape(r"[Nn]/[Aa]"), "notavailable"),
+                      (r"\s[Cc][Aa][.]\s", r" circa "),
+                      (r"\s[Cc][Aa] [.]", r" circa "),
+                      (r"(\s|[\(,])[Ed][Dd](\s|[\),])", r"\1 editor \2"),
+                      (r"\s[Ee][Dd] [.]", r" editor "),
+                      (r"(\s|[\(,])[Cc][Ff](\s|[\),])", r"\1 conferatur \2"),
+                      (r"\s[Cc][Ff] [.]", r" conferatur "),
+                      (r"\s*([Dd])[Rr][.]([\S]|\s)", r" \1octor \2"),
+                      (r"Sc[.]D[.]", "Doctor of Science"),
+                      (r"D[.]Sc[.]", "Doctor of Science"),
+                      (r"[SD][.][SD][.]", "Doctor of Science"),
+                      (r"([Ss])[r][.]", r"\1enior"),
+                      (r" theses(\s|^)", " thesises "),
+                      (re.escape("CMD."), "Cmd."),
+                      (re.escape("SGT."), "Sgt."),
+                      (r"(\d|\s)[Ff][Mm](\s|[.])", r"\1 frequency modulation \2"),
+                      (r"(\d|\s)[Aa][Mm](\s|[.])", r"\1 amplitude modulation \2"),
+                      (r"([(\[]|\s)ca[.] ", r"\1 circa "),
+                      (r"([Jj])[Rr][\\]*\'", r"\1unior  '"),
+                      (r" ([Jj])([Rr])[.]", r" \1unior "),
+                      (r" ([Jj])([Rr]) [.] ", r" \1unior "),
+                      (r" ([Jj])([Rr]) ", r" \1unior "),
+                      (r" ([Aa])([Dd])([.]|\s|^)", r" \1fter death of christ "),
+                      (r" ([Aa])([Dd])([,\)-]) ", r" \1fter death of christ \3 "),
+                      (r" ([Aa])([Dd])([,\)-])([,\)-]) ", r" \1fter death of christ \3 \4 "),
+                      (r" ([Bb])([Cc])([.]|\s|^)\s*", r" \1efore christ "),
+                      (r" ([Bb])([Cc])([,\)-]) ", r" \1efore christ \3 "),
+                      (r" ([Bb])([Cc])([,\)-])([,\)-]) ", r" \1efore christ \2 \3 ")]
+
     def use(self, f_holder, s):
-        # im is split by spacy to i m, don't want this
-        s = s.replace(r" im ", r" em ")
-        s = s.replace(r"[Nn]/[Aa]", "notavailable")
-        s = re.sub(r"\s[Cc][Aa][.]\s", r" circa ", s)
-        s = re.sub(r"\s[Cc][Aa] [.]", r" circa ", s)
-        s = re.sub(r"(\s|[\(,])[Ed][Dd](\s|[\),])", r"\1 editor \2", s)
-        s = re.sub(r"\s[Ee][Dd] [.]", r" editor ", s)
-        s = re.sub(r"(\s|[\(,])[Cc][Ff](\s|[\),])", r"\1 conferatur \2", s)
-        s = re.sub(r"\s[Cc][Ff] [.]", r" conferatur ", s)
-        s = re.sub(r"\s*([Dd])[Rr][.]([\S]|\s)", r" \1octor \2", s)
-        s = re.sub(r"Sc[.]D[.]", "Doctor of Science", s)
-        s = re.sub(r"D[.]Sc[.]", "Doctor of Science", s)
-        s = re.sub(r"[SD][.][SD][.]", "Doctor of Science", s)
-        s = re.sub(r"([Ss])[r][.]", r"\1enior", s)
-        s = re.sub(r" theses(\s|^)", " thesises ", s)
-        s = s.replace("CMD.", "Cmd.")
-        s = s.replace("SGT.", "Sgt.")
-        s = re.sub(r"(\d|\s)[Ff][Mm](\s|[.])", r"\1 frequency modulation \2", s)
-        s = re.sub(r"(\d|\s)[Aa][Mm](\s|[.])", r"\1 amplitude modulation \2", s)
-        s = re.sub(r"([(\[]|\s)ca[.] ", r"\1 circa ", s)
-        s = re.sub(r"([Jj])[Rr][\\]*\'", r"\1unior  '", s)
-        s = re.sub(r" ([Jj])([Rr])[.]", r" \1unior ", s)
-        s = re.sub(r" ([Jj])([Rr]) [.] ", r" \1unior ", s)
-        s = re.sub(r" ([Jj])([Rr]) ", r" \1unior ", s)
-        s = re.sub(r" ([Aa])([Dd])([.]|\s|^)", r" \1fter death of christ ", s)
-        s = re.sub(r" ([Aa])([Dd])([,\)-]) ", r" \1fter death of christ \3 ", s)
-        s = re.sub(r" ([Aa])([Dd])([,\)-])([,\)-]) ", r" \1fter death of christ \3 \4 ", s)
-        s = re.sub(r" ([Bb])([Cc])([.]|\s|^)\s*", r" \1efore christ ", s)
-        s = re.sub(r" ([Bb])([Cc])([,\)-]) ", r" \1efore christ \3 ", s)
-        s = re.sub(r" ([Bb])([Cc])([,\)-])([,\)-]) ", r" \1efore christ \2 \3 ", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class split_sentence_end_dots(TokenizeRule):
     _order = 12
     _name = "split sentence end dots"
     _desription = "words that end with dot should have their dot split from them"
+    _substitutions = [(r"([a-z]+)([.])(\s|^)", r"\1 \2 \3")]
+
     def use(self, f_holder, s):
-        s = re.sub(r"([a-z]+)([.])(\s|^)", r"\1 \2 \3", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class remove_bad_characters(TokenizeRule):
     _order = 13
     _name = "remove_bad_characters"
     _desription = "some characters we don't want to handle, and they don't work with regular expressions"
+    # characters replaced by space
+    _bad_characters = ['♠', '⁄', '+', '→', '×', '*', '±', '½', '…', '°', '⟨', '◌', 'ʰ', '⟩', 'Ã', '©', '®']
+    _substitutions = [CharacterMap({**dict.fromkeys(_bad_characters, ' '),
+                                    # characters just removed
+                                    '^': '',
+                                    # some characters look similar but are different, choose one common
+                                    '‚': ',',
+                                    # change № to #
+                                    '№': ' # '}),
+                      # normalize multiple prints of the same character
+                      (r'["]["]+', r'"'),
+                      # "' shouldn't be between each other
+                      # (r"\"'", r'"'),
+                      ]
 
     def use(self, f_holder, s):
-        # characters replace by space
-        bad_characters = ['♠', '⁄', '+', '→', '×', '*', '±', '½', '…', '°', '⟨', '⟨', '◌', 'ʰ', '⟩', 'Ã', '©', '®']
-        for bad in bad_characters:
-            s = s.replace(bad, ' ')
-        # characters just removed
-        s = s.replace('^', '')
-        # some characters look similar but are different, choose one common
-        s = re.sub(r"[‚,]", r",", s)
-        # normalize multiple prints of the same character
-        s = re.sub(r'["]["]+', r'"', s)
-        # change № to #
-        s = re.sub(r'[№]', r' # ', s)
-        # "' shouldn't be between each other
-        # s = re.sub(r"\"'", r'"', s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class slash_rule(TokenizeRule):
     _order = 14
     _name = "slash_rule"
     _desription = "put whitespace between /"
-    def use(self, f_holder, s):
+    _takes_tokens = True
+    _patterns = {'_slash_re': r"([/])"}
+
+    def use_tokens(self, f_holder, s):
         new_s = []
-        for i, word in enumerate(s.split(" ")):
+        for i, word in enumerate(s):
             # don't separate mixes of numbers and capital letters (often concepts or names/products)
             # this is to render problems with acapital_rule
             # also check that there are no lower-case characters
 
             # old code
             # if re.match(r'(?=.*[0-9])(?=.*[A-Z])([A-Z0-9]+)[/]([A-Z]+|[0-9]+)[^a-z]', word):
-            word = re.sub(r"([/])", r" \1 ", word)
+            word = self._slash_re.sub(r" \1 ", word)
             new_s.append(word)
             # if re.match(r'([A-Z-Z0-9]+)[/](?![A-Z0-9]+[a-z]+)([A-Z0-9]+)', word):
             #     new_s.append(word)
@@ -855,24 +2418,22 @@ class remove_simple_misstakes(TokenizeRule):
     _order = 17
     _name = "remove_simple_misstakes"
     _desription = "found some writings that might be mistakes or a condition that I don't understand, remove them"
+    # remove : from .: -- it doesn't have any use
+    _substitutions = [(r"[.][:]", r". ")]
+
     def use(self, f_holder, s):
-        # remove : from .: -- it doesn't have any use
-        s = re.sub(r"[.][:]", r". ", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 
 class UNILM_to_standard(TokenizeRule):
     _order = 25
     _name = "UNILM_to_standard"
     _description = "this rule turns the tokens UNILM use to the standard of this module"
+    _takes_tokens = True
+    _word_level = True
 
-    def use(self, f_holder, s):
-        s = s.split(" ")
-        for i, word in enumerate(s):
-            for unilm_token in self.UNILM_map.keys():
-                if word == unilm_token:
-                    s[i] = self.UNILM_map[unilm_token]
-        return f_holder, " ".join(s)
+    def use_word(self, f_holder, word):
+        return self.UNILM_map.get(word, word)
 
 
 # class unwanted_dotwords(TokenizeRule):
@@ -896,133 +2457,161 @@ class split_colon_rule(TokenizeRule):
     _order = 60
     _name = "split_colon_rule"
     _desription = "split colons that are not between numbers"
+    # split dot from end of numbers
+    _substitutions = [(r"([^\d]):([^\d])", r"\1 : \2 ")]
 
     def use(self, f_holder, s):
-        # split dot from end of numbers
-        s = re.sub(r"([^\d]):([^\d])", r"\1 : \2 ", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class three_dot_rule(TokenizeRule):
     _order = 61
     _name = 'three dot rule'
     _description = 'space triple dots'
+    _substitutions = [(r"(\s[A-Za-z]+)[.][.]", r"\1 ..."),
+                      # turn sequences of more than 3 dots to 3 dots
+                      (r"[.][.][.]+", r' ... '),
+                      # put space between dot and comma
+                      (r"[.][,]", r". ,"),
+                      # move triple dots from end of word
+                      (r"(\S)[.][.][.] ", r"\1 ... ")]
+
     def use(self, f_holder, s):
-        s = re.sub(r"(\s[A-Za-z]+)[.][.]", r"\1 ...", s)
-        # turn sequences of more than 3 dots to 3 dots
-        s = re.sub(r"[.][.][.]+", r' ... ', s)
-        # put space between dot and comma
-        s = re.sub(r"[.][,]", r". ,", s)
-        # move triple dots from end of word
-        s = re.sub(r"(\S)[.][.][.] ", r"\1 ... ", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class end_accent_rule(TokenizeRule):
     _order = 62
     _name = "end_accent_rule"
     _desription = "split the accent at end of any word, split accent from s, nt, re"
-
-    def use(self, f_holder, s):
-        s = s.split(" ")
-        for i, word in enumerate(s):
-            match = re.match(r"(.+?)'(([Ss])|([Ss])[,.])$", word)
-            if match:
-                s[i] = " ".join([match.group(1), "'", match.group(2)])
-            # else:
-            #     s[i] = re.sub(r"(.*?)'", r"\1 ' ", s[i])
-        s = " ".join(s)
-        return f_holder, s
+    _takes_tokens = True
+    _word_level = True
+    _patterns = {'_end_accent_re': r"(.+?)'(([Ss])|([Ss])[,.])$"}
+
+    def use_word(self, f_holder, word):
+        match = self._end_accent_re.match(word) if "'" in word else None
+        if match:
+            return [match.group(1), "'", match.group(2)]
+        # else:
+        #     s[i] = re.sub(r"(.*?)'", r"\1 ' ", s[i])
+        return word
 
 class two_word_dot_rule(TokenizeRule):
     _order = 65
     _name = "two_word_dot_words"
     _description = "all words that concist of two words ending with a dot should be not be split"
     _need_separate_list = True
+    # the words the expressions match never overlap, so one alternation matches the same words
+    _takes_tokens = True
+    _word_level = True
+    _patterns = {'_twoworddot_re': "|".join("(?:{})".format(regexp) for regexp in sorted(TWOWORDDOT_REGEXP))}
 
-    def use(self, f_holder, s):
-        s = s.split(" ")
-        for i, word in enumerate(s):
-            for regexp in f_holder.twoworddot_regexp:
-                if re.match(regexp, word):
-                    # move word to separate list
-                    f_holder.separate_twoworddot_list.append(word)
-                    s[i] = f_holder.twoworddot_replacement
-        return f_holder, " ".join(s)
+    def use_word(self, f_holder, word):
+        # all the expressions match a dot
+        if '.' in word and self._twoworddot_re.match(word):
+            # move word to separate list
+            f_holder.separate_twoworddot_list.append(word)
+            return f_holder.twoworddot_replacement
+        return word
 
 
 class feature_common_shortening_rule(TokenizeRule):
     _order = 81
     _name = "common_shortenings"
     _description = "remove the dots from common shortening of words"
+    _takes_tokens = True
+    _word_level = True
 
-    def use(self, f_holder, s):
-        s = s.split(" ")
-        for i, word in enumerate(s):
-            for j, ddshort in enumerate(f_holder.feature_ddshort_list):
-                if word == ddshort:
-                    s[i] = f_holder.feature_ddshort_tok_list[j]
-        s = " ".join(s)
-        return f_holder, s
+    def use_word(self, f_holder, word):
+        return f_holder.feature_ddshort_map.get(word, word)
 
 class currency_rule(TokenizeRule):
     # putting currency here to capture currenies as ALL CAPITAL
     _order = 85
     _name = "currency_rule"
     _desription = "turn $100, or £100 into # 100"
+    _substitutions = [(r' [rR][sS][.](\d)', r' # \1'), # Rs. rupees (indian)
+                      (r' [rR][sS][.] (\d)', r' # \1'), # Rs. rupees (indian)
+                      (r' [rR][sS] (\d)', r' # \1'), # Rs. rupees (indian)
+                      CharacterMap({'¢': ' cents ',
+                                    '₹': ''}), # remove yan(?)
+                      (r'([$£€¥])[$£€¥]+', r'\1'), # turn multiples of curency signs into single curency sign
+                      (r'[$£€¥](\d|([.]\d))', r" # \1"),
+                      (r'[$](US)', r" # \1"),
+                      (r'[$](T)(\d)', r" # \1 \2"),
+                      (r'[$](NZ)(\d|([.]\d))', r" # \1 \2")]
+
     def use(self, f_holder, s):
-        s = re.sub(r' [rR][sS][.](\d)', r' # \1', s) # Rs. rupees (indian)
-        s = re.sub(r' [rR][sS][.] (\d)', r' # \1', s) # Rs. rupees (indian)
-        s = re.sub(r' [rR][sS] (\d)', r' # \1', s) # Rs. rupees (indian)
-        s = re.sub(r'[¢]', r' cents ', s)
-        s = re.sub(r'[₹]', r'', s) # remove yan(?)
-        s = re.sub(r'([$£€¥])[$£€¥]+', r'\1', s) # turn multiples of curency signs into single curency sign
-        s = re.sub(r'[$£€¥](\d|([.]\d))', r" # \1", s)
-        s = re.sub(r'[$](US)', r" # \1", s)
-        s = re.sub(r'[$](T)(\d)', r" # \1 \2", s)
-        s = re.sub(r'[$](NZ)(\d|([.]\d))', r" # \1 \2", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class http_rule(TokenizeRule):
     _order = 150
     _name = "http rule"
     _description = "turn all links into tokens"
+    _patterns = {'_url_re': r'(http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+)\s',
+                 '_www_re': r'\swww[.][a-zA-Z0-9]+[.][A-Za-z]+\s',
+                 '_org_com_re': r'\s[A-Za-z0-9]+[.]((org)|(com))([.]{0,1})\s'}
 
     def use(self, f_holder, s):
-        s = re.sub(r'(http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+)\s', self._HTTP + " ", s)
-        s = re.sub(r'\swww[.][a-zA-Z0-9]+[.][A-Za-z]+\s', " " + self._HTTP + " ", s)
-        s = re.sub(r'\s[A-Za-z0-9]+[.]((org)|(com))([.]{0,1})\s', " " + self._HTTP + " ", s)
+        s = self._url_re.sub(self._HTTP + " ", s)
+        s = self._www_re.sub(" " + self._HTTP + " ", s)
+        s = self._org_com_re.sub(" " + self._HTTP + " ", s)
         return f_holder, s
 
 class feature_tag_acronym_rule(TokenizeRule):
     _order = 250
     _name = "feature_tag_acronym_rule"
     _description = "turn abreviations with dots into tokenized"
+    _patterns = {'_double_dot_re': r"([^.\s])[.][.]([^.\s])",
+                 '_acronym_re': r'([a-zA-Z][.]([a-zA-Z][.])+)',
+                 '_capital_acronym_re': r'[A-Z][.][A-Z][a-z]+([.]){0,1}'}
+    _takes_tokens = True
 
-    def use(self, f_holder, s):
+    def use_tokens(self, f_holder, tokens):
         # separate double dots wherever they are, not touching tripple dots
-        s = re.sub(r"([^.\s])[.][.]([^.\s])", r"\1. .\2", s)
-        s = s.split(" ")
+        s = []
+        for word in tokens:
+            if ".." in word:
+                s += self._double_dot_re.sub(r"\1. .\2", word).split(" ")
+            else:
+                s.append(word)
         for i, word in enumerate(s):
-            match = re.match(r'([a-zA-Z][.]([a-zA-Z][.])+)', word)
-            match2 = re.match(r'[A-Z][.][A-Z][a-z]+([.]){0,1}', word)
-            word = word.replace(".", "").upper()
-            if match or match2:
-                f_holder.feature_acronym_list.append(word)
-                s[i] = self.feature_acronym
-        return f_holder, " ".join(s)
+            # both expressions match a dot
+            if '.' in word:
+                acronym = self._acronym_shape(word)
+                if acronym is not None:
+                    f_holder.feature_acronym_list.append(acronym)
+                    s[i] = self.feature_acronym
+        return f_holder, s
+
+    @classmethod
+    @word_shape_cache
+    def _acronym_shape(cls, word):
+        """
+            The acronym without dots in upper case, None if word is not an acronym
+        """
+        match = cls._acronym_re.match(word)
+        match2 = cls._capital_acronym_re.match(word)
+        if match or match2:
+            return word.replace(".", "").upper()
+        return None
 
 class simple_quote_rule(TokenizeRule):
     _order = 399
+    _patterns = {'_quoted_word_re': r'\"[\S]+\"',
+                 '_double_quote_re': r'([\S]*)\"(.*)'}
+    _takes_tokens = True
 
     # TODO fix so that it doesn't conflict with inches
-    def use(self, f_holder, s):
-        s = s.split(" ")
+    def use_tokens(self, f_holder, s):
         result = []
         inside_quote = False
         for i, word in enumerate(s):
-            if re.match(r'\"[\S]+\"', word):
+            # both patterns need a double quote
+            if '"' not in word:
+                result.append(word)
+            elif self._quoted_word_re.match(word):
                 result += [self.LDQ, word[1:-1], self.RDQ]
-            elif re.match(r'([\S]*)\"(.*)', word):
-                match = re.match(r'([\S]*)\"(.*)', word)
+            elif self._double_quote_re.match(word):
+                match = self._double_quote_re.match(word)
                 if match.group(1):
                     result += [match.group(1)]
                 if inside_quote:
@@ -1035,148 +2624,233 @@ class simple_quote_rule(TokenizeRule):
                     result += [match.group(2)]
             else:
                 result += [word]
-        return f_holder, " ".join(result)
+        return f_holder, result
 
 
 class quote_rule(TokenizeRule):
     _order = 62
     _name = 'quote_rule'
     _description = "turn double and inner (single-quotes) into tokens. Single quotes can begin with ` or '."
+    _patterns = {'_quote_dot_re': r'(["]|[\'])[.]',
+                 '_dq_genitive_re': r'\"([\S]+)\'[s]\"',
+                 '_sq_genitive_re': r"\'([A-Za-z]+)\'[s]\'",
+                 '_dq_word_re': r'\"([\S]+)\"([\S]*)',
+                 '_dq_sq_word_re': r"\"'([A-Za-z]+)'",
+                 '_ldq_re': r'"',
+                 '_sq_word_rdq_re': r'(\')([\S]+)(\')([\S]*\")',
+                 '_sq_word_rdq_groups_re': r'\'([\S]+[^\s]*)\'([\S]*)(\")',
+                 '_ends_dq_re': r'.*"$',
+                 '_rsq_rdq_re': r'([\S^\']+)([^\s]*\')([\S]*)\"',
+                 '_inches_re': r'\d+"$',
+                 '_comma_lsq_re': r'([,])(\')([\S]+)',
+                 '_rdq_re': r'([\S]*)(\")([\.\,]*)',
+                 '_sq_word_re': r"[\'`][\S]+\'",
+                 '_lsq_re': r"^[\'`][\S]",
+                 '_rsq_punct_re': r"([\S]+)(\')([\,\.]+)",
+                 '_rsq_re': r"([\S]+)(\')$",
+                 '_genitive_re': r"([A-Za-z]+)\'([s])",
+                 '_apostrophe_after_re': r"([\S])' ",
+                 '_apostrophe_before_re': r" '([\S])"}
+    _takes_tokens = True
+
+
+    # what a word is to use_tokens, given by the first of the patterns below that matches it
+    (_NO_QUOTE, _DQ_GENITIVE, _SQ_GENITIVE, _DQ_WORD, _DQ_SQ_WORD, _LDQ, _SQ_WORD_RDQ, _ENDS_DQ,
+     _COMMA_LSQ, _RDQ, _SQ_WORD, _LSQ, _RSQ_PUNCT, _RSQ) = range(14)
+
+    @classmethod
+    @word_shape_cache
+    def _quote_shape(cls, word):
+        """
+            The kind of word and the parts of it that go into the result, (_NO_QUOTE, None) if no pattern matches
+        """
+        m = cls._dq_genitive_re.match(word)
+        if m:
+            return cls._DQ_GENITIVE, m.group(1)
+        m = cls._sq_genitive_re.match(word)
+        if m:
+            return cls._SQ_GENITIVE, m.group(1)
+        m = cls._dq_word_re.match(word)
+        if m:
+            return cls._DQ_WORD, (m.group(1), m.group(2))
+        m = cls._dq_sq_word_re.match(word)
+        if m:
+            return cls._DQ_SQ_WORD, m.group(1)
+        if cls._ldq_re.match(word):
+            return cls._LDQ, word[1:] if not len(word) == 1 else None
+        if cls._sq_word_rdq_re.match(word):
+            m = cls._sq_word_rdq_groups_re.match(word)
+            return cls._SQ_WORD_RDQ, (m.group(1), m.group(2))
+        if cls._ends_dq_re.match(word):
+            m = cls._rsq_rdq_re.match(word)
+            return cls._ENDS_DQ, (m.groups() if m and m.group(2) else None, bool(cls._inches_re.match(word)))
+        m = cls._comma_lsq_re.match(word)
+        if m:
+            return cls._COMMA_LSQ, (m.group(1), m.group(3))
+        m = cls._rdq_re.match(word)
+        if m:
+            return cls._RDQ, (m.group(1), m.group(3))
+        if cls._sq_word_re.match(word):
+            return cls._SQ_WORD, word[1:-1]
+        if cls._lsq_re.match(word):
+            return cls._LSQ, word[1:]
+        m = cls._rsq_punct_re.match(word)
+        if m:
+            return cls._RSQ_PUNCT, m.groups()
+        m = cls._rsq_re.match(word)
+        if m:
+            genitive = cls._genitive_re.match(m.group(1))
+            return cls._RSQ, (m.group(1), genitive.groups() if genitive else None)
+        return cls._NO_QUOTE, None
+
+    def use_tokens(self, f_holder, tokens):
+        # move dot after "
+        s = []
+        for word in tokens:
+            if '".' in word or "'." in word:
+                s += self._quote_dot_re.sub(r"\1 .", word).split(" ")
+            else:
+                s.append(word)
+
+        # classify the words, every pattern needs a quote so other words are left as they are.
+        # a closing double quote that was never opened is a typographic error or inches,
+        # the simple quote rule is used for the whole string then and nothing has been built yet
+        quote_shape = self._quote_shape
+        shapes = []
+        inside_quotes = 0
+        for word in s:
+            if '"' in word or "'" in word or '`' in word:
+                shape = quote_shape(word)
+                kind = shape[0]
+                if kind == self._LDQ or kind == self._DQ_SQ_WORD:
+                    inside_quotes += 1
+                elif kind == self._SQ_WORD_RDQ or kind == self._ENDS_DQ:
+                    if inside_quotes:
+                        inside_quotes -= 1
+                elif kind == self._RDQ:
+                    if not inside_quotes:
+                        if _diagnostics is not None:
+                            _diagnostics.record("quote_rule.simple_quote_fallback", word)
+                        return simple_quote_rule().use_tokens(f_holder, s)
+                    inside_quotes -= 1
+                shapes.append(shape)
+            else:
+                shapes.append(None)
 
-
-    def use(self, f_holder, s):
-        verbose = True
+        LDQ, RDQ, LSQ, RSQ = self.LDQ, self.RDQ, self.LSQ, self.RSQ
         result = []
-        # move dot after "
-        s = re.sub(r'(["]|[\'])[.]', r"\1 .", s)
-        s = s.split(" ")
-        inside_quotes = []
-        inside_simple_quotes = []
-        for i, word in enumerate(s):
-            # print(" ".join(result))
-            # print("inside_simple_quotes {}".format(inside_simple_quotes))
-            # print("inside_quotes {}".format(inside_quotes))
-            # match beginning "
-            if re.match(r'\"([\S]+)\'[s]\"', word):
-                m = re.match(r'\"([\S]+)\'[s]\"', word)
-                result += [self.LDQ, m.group(1), "'", "s", self.RDQ]
-            elif re.match(r"\'([A-Za-z]+)\'[s]\'", word):
-                m = re.match(r"\'([A-Za-z]+)\'[s]\'", word)
-                result += [self.LSQ, m.group(1), "'", "s", self.RSQ]
-            elif re.match(r'\"([\S]+)\"([\S]*)', word):
-                m = re.match(r'\"([\S]+)\"([\S]*)', word)
-                result += [self.LDQ, m.group(1), self.RDQ]
-                if m.group(2):
-                    result += [m.group(2)]
-            elif re.match(r"\"'([A-Za-z]+)'", word):
-                match = re.match(r"\"'([A-Za-z]+)'", word)
-                result += [self.LDQ, self.LSQ, match.group(1), self.RSQ]
-                inside_quotes.append(len(inside_quotes) + 1)
-                print(result)
-            elif re.match(r'"', word):
-                inside_quotes.append(len(inside_quotes) + 1)
-                result += [self.LDQ] + [word[1:]] if not len(word) == 1 else [self.LDQ]
+        inside_quotes = 0
+        inside_simple_quotes = 0
+        for word, shape in zip(s, shapes):
+            if shape is None:
+                result.append(word)
+                continue
+            kind, parts = shape
+            if kind == self._NO_QUOTE:
+                result.append(word)
+            elif kind == self._DQ_GENITIVE:
+                result += [LDQ, parts, "'", "s", RDQ]
+            elif kind == self._SQ_GENITIVE:
+                result += [LSQ, parts, "'", "s", RSQ]
+            elif kind == self._DQ_WORD:
+                result += [LDQ, parts[0], RDQ]
+                if parts[1]:
+                    result.append(parts[1])
+            elif kind == self._DQ_SQ_WORD:
+                result += [LDQ, LSQ, parts, RSQ]
+                inside_quotes += 1
+                if _diagnostics is not None:
+                    _diagnostics.record("quote_rule.double_quoted_single_quote", word)
+            elif kind == self._LDQ:
+                inside_quotes += 1
+                result += [LDQ] if parts is None else [LDQ, parts]
             # try to match double ' inside quote
-            elif re.match(r'(\')([\S]+)(\')([\S]*\")', word):
-                match = re.match(r'\'([\S]+[^\s]*)\'([\S]*)(\")', word)
-                result += [self.LSQ, match.group(1), self.RSQ, match.group(2)]
+            elif kind == self._SQ_WORD_RDQ:
+                result += [LSQ, parts[0], RSQ, parts[1]]
                 if inside_quotes:
-                    result += [self.RDQ]
-                    inside_quotes.pop(-1)
+                    result.append(RDQ)
+                    inside_quotes -= 1
                 else:
-                    result += ['"']
-                    print("found inches after closed single quotes")
-            elif re.match(r'.*"$', word):
-                # print("matched ending double quote")
-                match = re.match(r'([\S^\']+)([^\s]*\')([\S]*)\"', word)
-                if match and match.group(2):
-                    # print('matched group 2')
+                    result.append('"')
+                    if _diagnostics is not None:
+                        _diagnostics.record("quote_rule.inches_after_single_quotes", word)
+            elif kind == self._ENDS_DQ:
+                groups, inches = parts
+                if groups is not None:
                     if inside_simple_quotes:
-                        result += [match.group(1), self.RSQ, match.group(3)]
-                        inside_simple_quotes.pop(-1)
+                        result += [groups[0], RSQ, groups[2]]
+                        inside_simple_quotes -= 1
                     else:
-                        result += [match.group(1), "'", match.group(3)]
-                        print("found single quote without a starting single quotation")
+                        result += [groups[0], "'", groups[2]]
+                        if _diagnostics is not None:
+                            _diagnostics.record("quote_rule.unopened_single_quote", word)
                     if inside_quotes:
-                        result += [self.RDQ]
-                        inside_quotes.pop(-1)
+                        result.append(RDQ)
+                        inside_quotes -= 1
                     else:
-                        result += ['"']
-                        print("probably found inches")
+                        result.append('"')
+                        if _diagnostics is not None:
+                            _diagnostics.record("quote_rule.probable_inches", word)
                 elif not inside_quotes:
-                    # print("not matched group 2")
-                    if re.match(r'\d+"$', word):
-                        print("found inches")
-                        result += [word[:-1]] + ['inches']
+                    if inches:
+                        if _diagnostics is not None:
+                            _diagnostics.record("quote_rule.inches", word)
+                        result += [word[:-1], 'inches']
                     else:
-                        result += [word[:-1]] + ['"']
+                        result += [word[:-1], '"']
                 else:
-                    inside_quotes.pop(-1)
-                    result += [word[:-1]] + [self.RDQ]
-            elif re.match(r'([,])(\')([\S]+)', word):
-                print(word)
-                match = re.match(r'([,])(\')([\S]+)', word)
+                    inside_quotes -= 1
+                    result += [word[:-1], RDQ]
+            elif kind == self._COMMA_LSQ:
                 if not inside_simple_quotes:
-                    result += [match.group(1), self.LSQ, match.group(3)]
-                    inside_simple_quotes.append(len(inside_simple_quotes) + 1)
+                    result += [parts[0], LSQ, parts[1]]
+                    inside_simple_quotes += 1
                 else:
-                    print("found a starting quote right after , but already in a single quote expression")
-                    result += [match.group(1), "'", match.group(3)]
-            elif re.match(r'([\S]*)(\")([\.\,]*)', word):
-                if not inside_quotes:
-                    # if this happens, there is a typographic error in the text -- or we have caught a " that represents inches
-                    print("using simple quote rule")
-                    return simple_quote_rule().use(f_holder, " ".join(s))
-                else:
-                    match = re.match(r'([\S]*)(\")([\.\,]*)', word)
-                    result += [match.group(1), self.RDQ]
-                    # catch '.' after double quote
-                    if match.group(3):
-                        result += [match.group(3)]
-                    inside_quotes.pop(-1)
-            elif re.match(r"[\'`][\S]+\'", word):
-                result += [self.LSQ, word[1:-1], self.RSQ]
-            elif re.match(r"^[\'`][\S]", word):
-                inside_simple_quotes.append(len(inside_simple_quotes) + 1)
-                result += [self.LSQ, word[1:]]
-            elif re.match(r"([\S]+)(\')([\,\.]+)", word):
-                match = re.match(r"([\S]+)(\')([\,\.]+)", word)
+                    if _diagnostics is not None:
+                        _diagnostics.record("quote_rule.comma_single_quote_inside_single_quotes", word)
+                    result += [parts[0], "'", parts[1]]
+            elif kind == self._RDQ:
+                # an unopened one sent the string to the simple quote rule above
+                result += [parts[0], RDQ]
+                # catch '.' after double quote
+                if parts[1]:
+                    result.append(parts[1])
+                inside_quotes -= 1
+            elif kind == self._SQ_WORD:
+                result += [LSQ, parts, RSQ]
+            elif kind == self._LSQ:
+                inside_simple_quotes += 1
+                result += [LSQ, parts]
+            elif kind == self._RSQ_PUNCT:
                 if inside_simple_quotes:
-                    inside_simple_quotes.pop(-1)
-                    result += [match.group(1), self.RSQ, match.group(3)]
+                    inside_simple_quotes -= 1
+                    result += [parts[0], RSQ, parts[2]]
                 else:
-                    result += [match.group(1), ' ', match.group(2), ' ', match.group(3)]
-            elif re.match(r"([\S]+)(\')$", word):
-                match = re.match(r"([\S]+)(\')$", word)
+                    result += [parts[0], ' ', parts[1], ' ', parts[2]]
+            else:
+                quoted, genitive = parts
                 if inside_simple_quotes:
-                    inside_simple_quotes.pop(-1)
-                    match2 = re.match(r"([A-Za-z]+)\'([s])", match.group(1))
-                    if match2:
-                        result += [match2.group(1), "'", match2.group(2), self.RSQ]
+                    inside_simple_quotes -= 1
+                    if genitive:
+                        result += [genitive[0], "'", genitive[1], RSQ]
                     else:
-                        result += [match.group(1), self.RSQ]
+                        result += [quoted, RSQ]
                 else:
-                    print("found single quote without a starting single quotation")
-                    result += [match.group(1), "'"]
-            else:
-                result += [word]
-
-        # if the quotes are not closed, re-factor the changes
-        i = 0
-        while i < len(result):
-            if result[i] == self.LSQ:
-                found_end = False
-                for j in range(i+1, len(result)):
-                    if result[j] == self.RSQ:
-                        found_end = True
-                        i = j
-                if not found_end:
-                    result[i] = ''
-                    result[i+1] = "'" + result[i+1]
-            i += 1
+                    if _diagnostics is not None:
+                        _diagnostics.record("quote_rule.unopened_single_quote", word)
+                    result += [quoted, "'"]
+
+        # single quotes opened after the last closing one are not quotes, turn them back into apostrophes
+        last_rsq = len(result) - 1
+        while last_rsq >= 0 and result[last_rsq] != RSQ:
+            last_rsq -= 1
+        for i in range(last_rsq + 1, len(result)):
+            if result[i] == LSQ:
+                result[i] = ''
+                result[i+1] = "'" + result[i+1]
         result = " ".join(result)
-        result = re.sub(r"([\S])' ", r"\1 ' ", result)
-        result = re.sub(r" '([\S])", r" ' \1", result)
+        result = self._apostrophe_after_re.sub(r"\1 ' ", result)
+        result = self._apostrophe_before_re.sub(r" ' \1", result)
         return f_holder, result
 
 
@@ -1186,113 +2860,156 @@ class space_dot_rule(TokenizeRule):
     _order = 410
     _name = 'space dot rule'
     _description = 'put a space between word and ".", ",", "!" or "?"'
+    _substitutions = [(r"(\s[A-Za-z]+)[.][.]", r"\1 ..."),
+                      # turn sequences of more than 3 dots to 3 dots
+                      (r"[.][.][.]+", r' ... '),
+                      # put space between dot and comma
+                      (r"[.][,]", r". ,"),
+                      # move triple dots from end of word
+                      (r"(\S)[.][.][.] ", r"\1 ... "),
+                      (r"[.][.][.]", " DOTDOTDOT "),
+                      # split dots that are not between digits
+                      (r" ([^\d\.\s]+)[.]([^\d\.\s]+) ", r" \1 . \2 "),
+                      # split dots at end of sentence or words
+                      (r"([\s][^\s\.][^\s\.]+)([.])\s", r" \1 \2 "),
+                      # split dots from small letter characters
+                      (r"([\s][^A-Z\.\s])([.])\s", r" \1 \2 "),
+                      # split dots after %
+                      (r'([%])[.]', r"\1 ."),
+                      # split dots from mixes of numbers and letters,
+                      # TODO this will fail in other mixes of letters and numbers
+                      (r'([A-Za-z]+)[.]([0-9]+)', r" \1 . \2 "),
+                      (r'([0-9]+)[.]([A-Za-z]+)', r" \1 . \2 ")]
 
     def use(self, f_holder, s):
-        s = re.sub(r"(\s[A-Za-z]+)[.][.]", r"\1 ...", s)
-        # turn sequences of more than 3 dots to 3 dots
-        s = re.sub(r"[.][.][.]+", r' ... ', s)
-        # put space between dot and comma
-        s = re.sub(r"[.][,]", r". ,", s)
-        # move triple dots from end of word
-        s = re.sub(r"(\S)[.][.][.] ", r"\1 ... ", s)
-        s = re.sub(r"[.][.][.]", " DOTDOTDOT ", s)
-        # split dots that are not between digits
-        s = re.sub(r" ([^\d\.\s]+)[.]([^\d\.\s]+) ", r" \1 . \2 ", s)
-        # split dots at end of sentence or words
-        s = re.sub(r"([\s][^\s\.][^\s\.]+)([.])\s", r" \1 \2 ", s)
-        # split dots from small letter characters
-        s = re.sub(r"([\s][^A-Z\.\s])([.])\s", r" \1 \2 ", s)
-        # split dots after %
-        s = re.sub(r'([%])[.]', r"\1 .", s)
-        # split dots from mixes of numbers and letters,
-        # TODO this will fail in other mixes of letters and numbers
-        s = re.sub(r'([A-Za-z]+)[.]([0-9]+)', r" \1 . \2 ", s)
-        s = re.sub(r'([0-9]+)[.]([A-Za-z]+)', r" \1 . \2 ", s)
-        return f_holder, s
+        return f_holder, self.substitute(s)
 
 class pre_number_rule(TokenizeRule):
     _order = 415
     _name = 'pre_number_rule'
     _description = 'split the following from numbers: %, th, :, -, km'
+    _patterns = {'_number_re': r" (\d+) ",
+                 '_number_dot_re': r" (\d+[.])",
+                 '_number_size_re': r"(\d+[\.]*\d*)([KkMmGg]|(mm))",
+                 '_number_unit_re': r"(\d+)(([PpFfAa][Mm])|((ft)|(in)|[s]))",
+                 '_number_capital_re': r"(\d)([A-Z]+)"}
+    # catch numbers that are at end of sentences
+    _substitutions = [(r"[\s]([\S]*\d+)+[.] ", r" \1 . "),
+                      (r"[\s](\d+|\d+[,.]\d+)(th|%|[:]|[+]|cm|dm|m)[\s]", r" \1 \2 "),
+                      # split degrees
+                      (r"[\s](\d+|\d+[,.]\d+)(°)", r" \1 "),
+                      # remove ′ from numbers
+                      (r"[\s](\d+|\d+[,.]\d+)(′)[\s]", r" \1 "),
+                      # unique case 1.x, turn x into 0
+                      (r"[\s](\d)[.][x] ", r" \1.0 "),
+                      # remove from end of numbers?
+                      (r"\s(\d+)[?]", r" \1 "),
+                      # # add space between # and number
+                      (r"\s[#](\d+) ", r" # \1 ")]
 
     def use(self, f_holder, s):
         # large numbers somehow get's caught in a viscious loop
-        match = re.findall(r" (\d+) ", s)
+        match = self._number_re.findall(s)
         for m in match:
             if len(m) > 6:
                 s = s.replace(m, m[0:6])
-        match = re.findall(r" (\d+[.])", s)
+        match = self._number_dot_re.findall(s)
         for m in match:
             if len(m) > 6:
                 s = s.replace(m, m[0:6])
-        # catch numbers that are at end of sentences
-        s = re.sub(r"[\s]([\S]*\d+)+[.] ", r" \1 . ", s)
-        s = re.sub(r"[\s](\d+|\d+[,.]\d+)(th|%|[:]|[+]|cm|dm|m)[\s]", r" \1 \2 ", s)
-        # split degrees
-        s = re.sub(r"[\s](\d+|\d+[,.]\d+)(°)", r" \1 ", s)
-        # remove ′ from numbers
-        s = re.sub(r"[\s](\d+|\d+[,.]\d+)(′)[\s]", r" \1 ", s)
-        # unique case 1.x, turn x into 0
-        s = re.sub(r"[\s](\d)[.][x] ", r" \1.0 ", s)
-        # remove from end of numbers?
-        s = re.sub(r"\s(\d+)[?]", r" \1 ", s)
-        # # add space between # and number
-        s = re.sub(r"\s[#](\d+) ", r" # \1 ", s)
+        s = self.substitute(s)
         # # separate m, g, . at end of number
         s = s.split(" ")
         for i, word in enumerate(s):
-            s[i] = re.sub(r"(\d+[\.]*\d*)([KkMmGg]|(mm))", r"\1 \2", word)
-            s[i] = re.sub(r"(\d+)(([PpFfAa][Mm])|((ft)|(in)|[s]))", r"\1 \2", s[i])
-            s[i] = re.sub(r"(\d)([A-Z]+)", r"\1 \2", s[i])
+            s[i] = self._number_size_re.sub(r"\1 \2", word)
+            s[i] = self._number_unit_re.sub(r"\1 \2", s[i])
+            s[i] = self._number_capital_re.sub(r"\1 \2", s[i])
         return f_holder, " ".join(s)
 
 class feature_tag_acapital_rule(TokenizeRule):
     _order = 420
     _name = "feature_tag_acapital_rule"
     _desription = "mark words which consists of only capital letter"
+    _takes_tokens = True
+    _patterns = {'_acronym_re': r'([a-zA-Z]+[.]([a-zA-Z+]+[.])+)',
+                 '_capitalized_re': r"[A-Z][a-z]+"}
 
-    def use(self, f_holder, s):
-        s = s.split(" ")
+    def use_tokens(self, f_holder, s):
         insert_later = []
-        for i, word in enumerate(s):
-            word = word.strip()
-            match = re.match(r'([a-zA-Z]+[.]([a-zA-Z+]+[.])+)', word)
-            if match and i < len(s) - 1:
-                if re.match(r"[A-Z][a-z]+", s[i+1]):
+        shapes = [self._word_shape(word) for word in s]
+        last = len(s) - 1
+        for i, (is_acronym, _, capital_word) in enumerate(shapes):
+            if is_acronym and i < last:
+                if shapes[i + 1][1]:
                     # next word is start of new sentence
-                    word = word.replace(".", "").upper()
+                    capital_word = self._capital_word(s[i].strip().replace(".", "").upper())
                     insert_later.append(i+1+len(insert_later))
-            if word.isupper() and word not in f_holder.feature_list and len(word) > 1:
-                if not word[0] == '#' and not word[-1] == '#':
-                    # if word[-1] == '.' and len(word) >= 3:
-                    #     s[i] = f_holder.feature_acapital + " ."
-                    #     f_holder.feature_acapital_list.append(word[:-1])
-                    # else:
-                    s[i] = f_holder.feature_acapital
-                    f_holder.feature_acapital_list.append(word)
+            if capital_word is not None:
+                # if word[-1] == '.' and len(word) >= 3:
+                #     s[i] = f_holder.feature_acapital + " ."
+                #     f_holder.feature_acapital_list.append(word[:-1])
+                # else:
+                s[i] = f_holder.feature_acapital
+                f_holder.feature_acapital_list.append(capital_word)
         for idx in insert_later:
             s.insert(idx, ".")
-        return f_holder, " ".join(s)
+        return f_holder, s
+
+    @classmethod
+    @word_shape_cache
+    def _word_shape(cls, word):
+        """
+            Whether the stripped word is an acronym, whether word is capitalized and
+            the stripped word if it consists of only capital letters, else None
+        """
+        stripped = word.strip()
+        return (cls._acronym_re.match(stripped) is not None,
+                cls._capitalized_re.match(word) is not None,
+                cls._capital_word(stripped))
+
+    @classmethod
+    @word_shape_cache
+    def _capital_word(cls, word):
+        if word.isupper() and word not in FeatureHolder.feature_list and len(word) > 1:
+            if not word[0] == '#' and not word[-1] == '#':
+                return word
+        return None
 
 class feature_tag_number_rule(TokenizeRule):
     _order = 999
     _name = 'feature_tag_number_rule'
     _description = 'will catch any string starting with a number with , or . in it'
+    _takes_tokens = True
+    _patterns = {'_multi_dot_number_re': r"(\d+[.]\d+)([.]\d+)+",
+                 '_no_alphabet_number_re': r'(?!(((\d+)(([,.]*)([\d]+))*)[A-Za-z]+))((\d+)(([,.]*)([\d]+))*)',
+                 '_no_slash_number_re': r'(?!(\d+[/]\d+))'}
 
-    def use(self, f_holder, s):
-        s = s.split(" ")
+    def use_tokens(self, f_holder, s):
         for i, word in enumerate(s):
-            # TODO recognize numbers that have more than one dot and categorize them atm just subtract extra dots and numbers
-            match = re.match(r"(\d+[.]\d+)([.]\d+)+", word)
-            if match:
-                word = match.groups()[0]
-            # regular expression checks that the numbers don't end with a alphabet character
-            no_alphabet_match = re.match(r'(?!(((\d+)(([,.]*)([\d]+))*)[A-Za-z]+))((\d+)(([,.]*)([\d]+))*)', word)
-            no_slash_match = re.match(r'(?!(\d+[/]\d+))', word)
-            if no_alphabet_match and no_slash_match:
-                s[i] = self.NUMBER
-                f_holder.feature_number_list.append(word)
-        return f_holder, " ".join(s)
+            # every number starts with a digit
+            if word[:1].isdecimal():
+                number = self._number_shape(word)
+                if number is not None:
+                    s[i] = self.NUMBER
+                    f_holder.feature_number_list.append(number)
+        return f_holder, s
+
+    @classmethod
+    @word_shape_cache
+    def _number_shape(cls, word):
+        """
+            The number in word, None if word is not a number
+        """
+        # TODO recognize numbers that have more than one dot and categorize them atm just subtract extra dots and numbers
+        match = cls._multi_dot_number_re.match(word)
+        if match:
+            word = match.groups()[0]
+        # regular expression checks that the numbers don't end with a alphabet character
+        no_alphabet_match = cls._no_alphabet_number_re.match(word)
+        no_slash_match = cls._no_slash_number_re.match(word)
+        if no_alphabet_match and no_slash_match:
+            return word
+        return None
 
 class clean_whitespace_rule(TokenizeRule):
     _order = 9998
@@ -1303,100 +3020,433 @@ class clean_whitespace_rule(TokenizeRule):
         return f_holder, single_whitespace(s).strip(" ")
 
 
+def _expand_literals(pattern):
+    """
+        All strings matched by a pattern made of plain characters, escaped characters, groups and
+        character sets like [Hh], None for patterns using any other syntax
+    """
+    choices = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char in '()':
+            i += 1
+        elif char == '\\':
+            if i + 1 == len(pattern) or pattern[i + 1].isalnum():
+                return None
+            choices.append(pattern[i + 1])
+            i += 2
+        elif char == '[':
+            end = pattern.find(']', i)
+            if end == -1 or any(c in '\\^-[' for c in pattern[i + 1:end]):
+                return None
+            choices.append(pattern[i + 1:end])
+            i = end + 1
+        elif char in '.^$*+?{}|':
+            return None
+        else:
+            choices.append(char)
+            i += 1
+    return ["".join(chars) for chars in itertools.product(*choices)]
+
+def _trie_pattern(words):
+    """
+        A regular expression matching any of words, none of which may start another, with the alternatives
+        nested by common prefix so a match is found with one test per character
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items())]
+        if len(branches) < 2:
+            return "".join(branches)
+        return "(?:" + "|".join(branches) + ")"
+    return build(trie)
+
+
 class spacy_special_word_rules(TokenizeRule):
     _order = 9999
     _name = 'spacy_special_word_rules'
     _description = 'spacy splits some words, do that to'
+    _substitutions = [(r"([Hh]as)n\'t", r"\1 not"),
+                      (r"([Ss]hould)n\'t", r"\1 not"),
+                      (r"([Cc]ould)n\'t", r"\1 not"),
+                      (r"([Yy]ou)\'ll", r" \1 will "),
+                      (r"([Tt]hat)\'ll", r" \1 will "),
+                      (r"([Tt]here)\'ll", r" \1 will "),
+                      (r"([Ii]t)\'ll", r" \1 will "),
+                      (r"([Yy]ou)\'d", r" \1 d "),
+                      (r" ([Tt])heses ", r" \1hesises "),
+                      (r"([Aa]re)n't", r"\1 not"),
+                      (r"([Ii]s)n't", r"\1 not"),
+                      (r"([Mm]ust)n't", r"\1 not"),
+                      (r"([Dd]o)n't", r"\1 not"),
+                      (r"([Dd]id)n't", r"\1 not"),
+                      (r"([Ss]h)e'll", r"\1e will"),
+                      (r"([Hh])e'll", r"\1e will"),
+                      (r"([Ww])on't", r"\1ill not"),
+                      (r"([Tt]hey)'re", r"\1 are"),
+                      (r"([Tt]hey)'ve", r"\1 have"),
+                      (r"([Tt]hey)'ll", r"\1 will"),
+                      (r"([Dd]oes)nt", r"\1 not"),
+                      (r"([Ww]e)'ve", r"\1 have"),
+                      (r"([Ii])'m", r"\1 am"),
+                      (r" ([Ii])m ", r" \1 am "),
+                      (r"([Tt]hey)'d", r"\1 d"),
+                      (r"([Gg]ot)ta", r"\1 to"),
+                      (r"([Ww]e)\'re", r"\1 are"),
+                      (r"([Ww]e)\'ll", r"\1 will"),
+                      (r"([Ww]ere)n\'t", r"\1 not"),
+                      (r"([Dd]oes)n\'t", r"\1 not"),
+                      (r"([Cc]an)t", r"\1 not"),
+                      (r"([Cc]an)\'t", r"\1 not"),
+                      (r"([Cc]ould)\'ve", r"\1 have"),
+                      (r"([Yy]ou)\'ve", r"\1 have"),
+                      (r"([Yy]ou)\'re", r"\1 are"),
+                      (r"([Gg])onna", r"\1oing to"),
+                      (r"([Nn]eed)n\'t", r"\1 not"),
+                      (r"([Hh]ad)n\'t", r"\1 not"),
+                      (r"([Ww]ould)\'ve", r"\1 have"),
+                      (r"([Ww]ould)n\'t", r"\1 not"),
+                      (r"([Ww]ho)\'ve", r"\1 have"),
+                      (r"([Hh]ave)n\'t", r"\1 not")]
+
+    # special words are replaced with str.replace after the substitutions, in this order
+    _special_words = {
+                     ' Ive ': " I have ",
+                     ' wed ': " wedded ",
+                     ' id ': ' identification ',
+                     # quick fix, this is a name
+                     ' Arent ': ' Are not ',
+                     ' arent ': ' are not ',
+                     " ca.": 'circa',
+                     " ca .": 'circa',
+                     "I'd": 'I d',
+                     "it'd": "it d",
+                     "he'd": 'he d',
+                     "He'd": "He d",
+                     "she'd": 'she d',
+                     "who'd": "who d",
+                     "we'd": "we d",
+                     "We'd": "We d",
+                     "Wed": "We d",
+                     "there'd": "there d",
+                     "There'd": "There d",
+                     "That'd": "That d",
+                     "that'd": "that d",
+                     "Who'll": "Who will",
+                     "who'll": "who will",
+                     "Where'd": "Where did",
+                     "where'd": "where did",
+                     "might've": "might have",
+                     "didnt": "did not",
+                     "Doesn't": "Does not",
+                     "Should've": "Should have",
+                     "should've": "should have",
+                     "wasn't": "was not",
+                     "cannot": "can not",
+                     "hasn't": "has not",
+                     "I'll": "I will",
+                     "I've": "I have",
+                     "ain't": "is not",
+                     "Ain't": "Is not",
+                     "Wasn't": "Was not",
+                     "y'all": "you all",
+                     " Id ": " Identifier ",
+                     "Sr . ": "Senior ",
+                     "sr . ": "senior ",
+                     "c'mon": "come on",
+                     }
+
+    @classmethod
+    def compile(cls):
+        """
+            Also expand the substitutions and special words into the literal strings they match and compile
+            these into one trie shaped regular expression, with a table from literal to step and replacement
+        """
+        if not cls.__dict__.get('_is_compiled', False):
+            with _compile_lock:
+                if not cls.__dict__.get('_is_compiled', False):
+                    table = {}
+                    for step, (pattern, replacement) in enumerate(cls._substitutions):
+                        compiled = re.compile(pattern)
+                        literals = _expand_literals(pattern)
+                        if literals is None or not all(compiled.fullmatch(literal) for literal in literals):
+                            table = None
+                            break
+                        for literal in literals:
+                            table.setdefault(literal, (step, compiled.sub(replacement, literal)))
+                    if table is not None:
+                        for step, (key, value) in enumerate(cls._special_words.items(), len(cls._substitutions)):
+                            table.setdefault(key, (step, value))
+                    # a literal that starts another one could match at the same place, the scan can't tell those apart
+                    if table is not None and any(other != literal and other.startswith(literal) for literal in table for other in table):
+                        table = None
+                    cls._special_word_table = table
+                    cls._special_word_re = re.compile(_trie_pattern(table)) if table else None
+                    cls._special_word_longest = max(map(len, table)) if table else 0
+                    super().compile()
+        return cls
 
     def use(self, f_holder, s):
-        map = {
-               ' Ive ': " I have ",
-               ' wed ': " wedded ",
-               ' id ': ' identification ',
-               # quick fix, this is a name
-               ' Arent ': ' Are not ',
-               ' arent ': ' are not ',
-               " ca.": 'circa',
-               " ca .": 'circa',
-               "I'd": 'I d',
-               "it'd": "it d",
-               "he'd": 'he d',
-               "He'd": "He d",
-               "she'd": 'she d',
-               "who'd": "who d",
-               "we'd": "we d",
-               "We'd": "We d",
-               "Wed": "We d",
-               "there'd": "there d",
-               "There'd": "There d",
-               "That'd": "That d",
-               "that'd": "that d",
-               "Who'll": "Who will",
-               "who'll": "who will",
-               "Where'd": "Where did",
-               "where'd": "where did",
-               "might've": "might have",
-               "didnt": "did not",
-               "Doesn't": "Does not",
-               "Should've": "Should have",
-               "should've": "should have",
-               "wasn't": "was not",
-               "cannot": "can not",
-               "hasn't": "has not",
-               "I'll": "I will",
-               "I've": "I have",
-               "ain't": "is not",
-               "Ain't": "Is not",
-               "Wasn't": "Was not",
-               "y'all": "you all",
-               " Id ": " Identifier ",
-               "Sr . ": "Senior ",
-               "sr . ": "senior ",
-               "c'mon": "come on",
-               }
-        s = re.sub(r"([Hh]as)n\'t", r"\1 not", s)
-        s = re.sub(r"([Ss]hould)n\'t", r"\1 not", s)
-        s = re.sub(r"([Cc]ould)n\'t", r"\1 not", s)
-        s = re.sub(r"([Yy]ou)\'ll", r" \1 will ", s)
-        s = re.sub(r"([Tt]hat)\'ll", r" \1 will ", s)
-        s = re.sub(r"([Tt]here)\'ll", r" \1 will ", s)
-        s = re.sub(r"([Ii]t)\'ll", r" \1 will ", s)
-        s = re.sub(r"([Yy]ou)\'d", r" \1 d ", s)
-        s = re.sub(r" ([Tt])heses ", r" \1hesises ", s)
-        s = re.sub(r"([Aa]re)n't", r"\1 not", s)
-        s = re.sub(r"([Ii]s)n't", r"\1 not", s)
-        s = re.sub(r"([Mm]ust)n't", r"\1 not", s)
-        s = re.sub(r"([Dd]o)n't", r"\1 not", s)
-        s = re.sub(r"([Dd]id)n't", r"\1 not", s)
-        s = re.sub(r"([Ss]h)e'll", r"\1e will", s)
-        s = re.sub(r"([Hh])e'll", r"\1e will", s)
-        s = re.sub(r"([Ww])on't", r"\1ill not", s)
-        s = re.sub(r"([Tt]hey)'re", r"\1 are", s)
-        s = re.sub(r"([Tt]hey)'ve", r"\1 have", s)
-        s = re.sub(r"([Tt]hey)'ll", r"\1 will", s)
-        s = re.sub(r"([Dd]oes)nt", r"\1 not", s)
-        s = re.sub(r"([Ww]e)'ve", r"\1 have", s)
-        s = re.sub(r"([Ii])'m", r"\1 am", s)
-        s = re.sub(r" ([Ii])m ", r" \1 am ", s)
-        s = re.sub(r"([Tt]hey)'d", r"\1 d", s)
-        s = re.sub(r"([Gg]ot)ta", r"\1 to", s)
-        s = re.sub(r"([Ww]e)\'re", r"\1 are", s)
-        s = re.sub(r"([Ww]e)\'ll", r"\1 will", s)
-        s = re.sub(r"([Ww]ere)n\'t", r"\1 not", s)
-        s = re.sub(r"([Dd]oes)n\'t", r"\1 not", s)
-        s = re.sub(r"([Cc]an)t", r"\1 not", s)
-        s = re.sub(r"([Cc]an)\'t", r"\1 not", s)
-        s = re.sub(r"([Cc]ould)\'ve", r"\1 have", s)
-        s = re.sub(r"([Yy]ou)\'ve", r"\1 have", s)
-        s = re.sub(r"([Yy]ou)\'re", r"\1 are", s)
-        s = re.sub(r"([Gg])onna", r"\1oing to", s)
-        s = re.sub(r"([Nn]eed)n\'t", r"\1 not", s)
-        s = re.sub(r"([Hh]ad)n\'t", r"\1 not", s)
-        s = re.sub(r"([Ww]ould)\'ve", r"\1 have", s)
-        s = re.sub(r"([Ww]ould)n\'t", r"\1 not", s)
-        s = re.sub(r"([Ww]ho)\'ve", r"\1 have", s)
-        s = re.sub(r"([Hh]ave)n\'t", r"\1 not", s)
-        for key, value in map.items():
+        result = self._rewrite_in_one_scan(s) if self._special_word_re is not None else None
+        if result is None:
+            result = self._rewrite_in_order(s)
+        return f_holder, result
+
+    def _rewrite_in_order(self, s):
+        """
+            Run the substitutions and replace the special words, one scan of s for each
+        """
+        s = self.substitute(s)
+        for key, value in self._special_words.items():
             s = s.replace(key, value)
-        return f_holder, s
+        return s
 
+    def _rewrite_in_one_scan(self, s):
+        """
+            Replace every literal in a single scan of s. This gives the same string as _rewrite_in_order as long as
+            no two literals overlap in s and no replacement forms a literal of a later step with the text around it
+            at the time its step runs, None is returned when either happens.
+        """
+        search = self._special_word_re.search
+        match = search(s)
+        if match is None:
+            return s
+        table = self._special_word_table
+        matches = []
+        last_end = 0
+        while match is not None:
+            start, end = match.span()
+            if start < last_end:
+                return None
+            step, replacement = table[match.group()]
+            matches.append((start, end, step, replacement))
+            last_end = end
+            match = search(s, start + 1)
+
+        # a literal overlapping a replacement lies within longest - 1 characters of it on either side
+        reach = self._special_word_longest - 1
+        for i, (start, end, step, replacement) in enumerate(matches):
+            before = self._text_at_step(s, matches, i, step, reach, -1)
+            after = self._text_at_step(s, matches, i, step, reach, 1)
+            text = before + replacement + after
+            first = len(before)
+            last = max(first + len(replacement), first + 1)
+            match = search(text)
+            while match is not None and match.start() < last:
+                if match.end() > first and table[match.group()][0] > step:
+                    return None
+                match = search(text, match.start() + 1)
+
+        pieces = []
+        last_end = 0
+        for start, end, _, replacement in matches:
+            pieces.append(s[last_end:start])
+            pieces.append(replacement)
+            last_end = end
+        pieces.append(s[last_end:])
+        return "".join(pieces)
+
+    @staticmethod
+    def _text_at_step(s, matches, i, step, reach, direction):
+        """
+            The reach characters before (direction -1) or after (direction 1) matches[i] once its step has run,
+            with the literals of that step and the earlier ones replaced and the others still as in s
+        """
+        pieces = []
+        length = 0
+        j = i + direction
+        position = matches[i][0] if direction < 0 else matches[i][1]
+        while length < reach:
+            if direction < 0:
+                gap_start = matches[j][1] if j >= 0 else 0
+                piece = s[max(gap_start, position - reach + length):position]
+            else:
+                gap_end = matches[j][0] if j < len(matches) else len(s)
+                piece = s[position:min(gap_end, position + reach - length)]
+            pieces.append(piece)
+            length += len(piece)
+            if length >= reach or not 0 <= j < len(matches):
+                break
+            start, end, other_step, replacement = matches[j]
+            piece = replacement if other_step <= step else s[start:end]
+            pieces.append(piece)
+            length += len(piece)
+            position = start if direction < 0 else end
+            j += direction
+        if direction < 0:
+            return "".join(reversed(pieces))[-reach:] if reach else ""
+        return "".join(pieces)[:reach]
+
+
+# command line: python -m custom_tokenizer corpus.txt -o tokens.jsonl
+
+_worker_pretokenizer = None
+
+def _init_worker(redirect_stdout=True, cache_path=None, diagnostics_samples=None):
+    """
+        Build the pipeline once per worker process and keep anything printed out of the JSONL on stdout.
+        With cache_path the workers share their results through one SQLite file,
+        with diagnostics_samples they record the events of the rules.
+    """
+    global _worker_pretokenizer
+    import sys
+    if redirect_stdout:
+        sys.stdout = sys.stderr
+    if diagnostics_samples is not None:
+        enable_diagnostics(samples=diagnostics_samples)
+    cache = ResultCache(path=cache_path) if cache_path else None
+    _worker_pretokenizer = make_new_pretokenizer(cache=cache)
+    _worker_pretokenizer.compile()
+
+def _tokenize_chunk(chunk, offsets=False):
+    """
+        Tokenize a chunk of (line number, text) pairs, returns the JSON lines, the number of tokens
+        and the diagnostics recorded for the chunk, None when they are disabled
+    """
+    import json
+    results = _worker_pretokenizer.tokenize_batch([text for _, text in chunk], offsets=offsets)
+    lines = []
+    n_tokens = 0
+    for (number, _), result in zip(chunk, results):
+        n_tokens += len(result.tokens)
+        record = {'line': number, 'tokens': result.tokens, 'features': result.features}
+        if offsets:
+            record['offsets'] = result.offsets
+        lines.append(json.dumps(record, ensure_ascii=False))
+    diagnostics = _diagnostics.take() if _diagnostics is not None else None
+    return lines, n_tokens, diagnostics
+
+def _read_corpus(stream, input_format, field):
+    """
+        Yield (line number, text) for every non-empty line of a text file or record of a JSONL file,
+        records that are not JSON objects with a string under field are reported on stderr and skipped
+    """
+    import json
+    import sys
+    for number, line in enumerate(stream, 1):
+        line = line.rstrip("\n")
+        if not line.strip():
+            continue
+        if input_format == "jsonl":
+            try:
+                line = json.loads(line)[field]
+            except ValueError as e:
+                print("line {}: not valid JSON ({}), skipped".format(number, e), file=sys.stderr)
+                continue
+            except (KeyError, TypeError):
+                print("line {}: no {!r} field, skipped".format(number, field), file=sys.stderr)
+                continue
+            if not isinstance(line, str):
+                print("line {}: {!r} is not a string, skipped".format(number, field), file=sys.stderr)
+                continue
+        yield number, line
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+def main(argv=None):
+    import argparse
+    import contextlib
+    import sys
+
+    parser = argparse.ArgumentParser(prog="python -m custom_tokenizer",
+                                     description="Tokenize a corpus with make_new_pretokenizer and write tokens and feature tags as JSONL.")
+    parser.add_argument("input", help="text file with one string per line or JSONL file with one record per line, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL file to write, - for stdout (default)")
+    parser.add_argument("--format", choices=["text", "jsonl"], default=None,
+                        help="input format, taken from the file extension when not given")
+    parser.add_argument("--field", default="text", help="key of the text in JSONL records (default: text)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="strings sent to a worker at a time (default: 1000)")
+    parser.add_argument("--unordered", action="store_true",
+                        help="write chunks as soon as they are done instead of in input order, every record keeps its line number")
+    parser.add_argument("--offsets", action="store_true",
+                        help="also write the [start, end] character offsets of every token in the input text")
+    parser.add_argument("--diagnostics", type=int, nargs="?", const=3, default=None, metavar="SAMPLES",
+                        help="count the events of the rules, such as unclosed quotes, and report them on stderr with SAMPLES examples each (default: 3)")
+    parser.add_argument("--cache", default=None, metavar="PATH",
+                        help="SQLite file to keep results in, strings tokenized before with the same rules are looked up instead")
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size must be at least 1")
+    input_format = args.format
+    if input_format is None:
+        input_format = "jsonl" if args.input.endswith((".jsonl", ".jsonl.txt", ".ndjson")) else "text"
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    n_strings = 0
+    n_tokens = 0
+    diagnostics = Diagnostics(samples=args.diagnostics) if args.diagnostics is not None else None
+    start = time.time()
+
+    def write(done):
+        nonlocal n_strings, n_tokens
+        lines, tokens, chunk_diagnostics = done
+        n_strings += len(lines)
+        n_tokens += tokens
+        if chunk_diagnostics is not None:
+            diagnostics.merge(chunk_diagnostics)
+        for line in lines:
+            out.write(line)
+            out.write("\n")
+
+    chunks = _chunked(_read_corpus(source, input_format, args.field), args.chunk_size)
+    try:
+        if args.workers == 1:
+            with contextlib.redirect_stdout(sys.stderr):
+                _init_worker(redirect_stdout=False, cache_path=args.cache, diagnostics_samples=args.diagnostics)
+                for chunk in chunks:
+                    write(_tokenize_chunk(chunk, args.offsets))
+        else:
+            import concurrent.futures
+            # keep a few chunks per worker in flight so memory does not grow with the corpus
+            max_pending = 2 * args.workers
+            with concurrent.futures.ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                                                        initargs=(True, args.cache, args.diagnostics)) as executor:
+                if args.unordered:
+                    pending = set()
+                    for chunk in chunks:
+                        if len(pending) >= max_pending:
+                            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                            for future in done:
+                                write(future.result())
+                        pending.add(executor.submit(_tokenize_chunk, chunk, args.offsets))
+                    for future in concurrent.futures.as_completed(pending):
+                        write(future.result())
+                else:
+                    pending = collections.deque()
+                    for chunk in chunks:
+                        if len(pending) >= max_pending:
+                            write(pending.popleft().result())
+                        pending.append(executor.submit(_tokenize_chunk, chunk, args.offsets))
+                    while pending:
+                        write(pending.popleft().result())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+        else:
+            out.flush()
+
+    elapsed = max(time.time() - start, 1e-9)
+    print("tokenized {} strings, {} tokens in {:.2f}s: {:.0f} strings/s, {:.0f} tokens/s with {} worker(s)".format(
+          n_strings, n_tokens, elapsed, n_strings / elapsed, n_tokens / elapsed, args.workers), file=sys.stderr)
+    if diagnostics is not None:
+        print(diagnostics.report() or "no diagnostics recorded", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
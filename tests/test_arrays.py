@@ -0,0 +1,50 @@
+import pytest
+
+import custom_tokenizer
+
+np = pytest.importorskip("numpy")
+
+TEXTS = ["The U.S.A. and NASA met 5 Docs", "hi", "Dr. Smith won't pay $5,000 to IBM today"]
+
+
+@pytest.fixture(scope="module")
+def expected():
+    pretokenizer = custom_tokenizer.make_new_pretokenizer()
+    return [pretokenizer.tokenize(text) for text in TEXTS]
+
+
+@pytest.mark.parametrize("padded", [False, True])
+def test_arrays_hold_the_tags_of_tokenize(expected, padded):
+    arrays = custom_tokenizer.make_new_pretokenizer().tokenize_batch_arrays(TEXTS, padded=padded)
+    assert len(arrays) == len(TEXTS)
+    assert list(arrays.lengths) == [len(result.tokens) for result in expected]
+    for i, result in enumerate(expected):
+        assert arrays.get_tokens(i) == result.tokens
+        features = arrays.get_features(i)
+        assert set(features) == set(custom_tokenizer.FEATURE_TAGS)
+        for name, tags in features.items():
+            assert tags.dtype == np.int8
+            assert tags.tolist() == result.features[name]
+
+
+def test_unpadded_arrays_are_one_row_per_tag(expected):
+    arrays = custom_tokenizer.make_new_pretokenizer().tokenize_batch_arrays(TEXTS)
+    total = sum(len(result.tokens) for result in expected)
+    assert list(arrays.offsets) == [0, len(expected[0].tokens), len(expected[0].tokens) + len(expected[1].tokens), total]
+    assert all(tags.shape == (total,) for tags in arrays.features.values())
+
+
+def test_padded_arrays_are_padded_with_zeros(expected):
+    arrays = custom_tokenizer.make_new_pretokenizer().tokenize_batch_arrays(TEXTS, padded=True)
+    width = max(len(result.tokens) for result in expected)
+    assert arrays.offsets is None
+    for tags in arrays.features.values():
+        assert tags.shape == (len(TEXTS), width)
+        for i, result in enumerate(expected):
+            assert not tags[i, len(result.tokens):].any()
+
+
+def test_empty_batch():
+    for padded in (False, True):
+        arrays = custom_tokenizer.make_new_pretokenizer().tokenize_batch_arrays([], padded=padded)
+        assert len(arrays) == 0
@@ -0,0 +1,45 @@
+import pytest
+
+import custom_tokenizer
+
+TEXT = "see http://example.com now"
+
+
+def _http_rule(pretokenizer):
+    return next(rule for rule in pretokenizer.rules if isinstance(rule, custom_tokenizer.http_rule))
+
+
+def test_reconfigured_rule_is_not_answered_from_the_cache():
+    pretokenizer = custom_tokenizer.make_new_pretokenizer(cache=custom_tokenizer.ResultCache())
+    assert "http" in pretokenizer.tokenize(TEXT).tokens
+
+    _http_rule(pretokenizer)._HTTP = "LINK"
+    assert "LINK" in pretokenizer.tokenize(TEXT).tokens
+    assert "LINK" in pretokenizer.tokenize_batch([TEXT])[0].tokens
+
+
+def test_cache_hits_do_not_share_lists():
+    pretokenizer = custom_tokenizer.make_new_pretokenizer(cache=custom_tokenizer.ResultCache())
+    text = "The U.S.A. and NASA met"
+    tokens = list(pretokenizer.tokenize(text).tokens)
+
+    hit = pretokenizer.tokenize(text)
+    hit.tokens.append("changed")
+    pretokenizer.f_holder.before_spacy()
+    pretokenizer.tokenize_batch([text])[0].tokens.clear()
+    assert pretokenizer.tokenize(text).tokens == tokens
+    assert pretokenizer.cache.hits == 3
+
+
+def test_differently_trained_splitters_are_cached_apart():
+    punkt = pytest.importorskip("nltk.tokenize.punkt")
+    default = custom_tokenizer.PunktSentenceSplitter()
+    default._tokenizer = punkt.PunktSentenceTokenizer()
+    trained = custom_tokenizer.PunktSentenceSplitter()
+    trained._tokenizer = punkt.PunktSentenceTokenizer()
+    trained._tokenizer._params.abbrev_types.add("xyz")
+
+    cache = custom_tokenizer.ResultCache()
+    paragraph = "I met the xyz. Smith was there."
+    assert len(custom_tokenizer.wrapped_nltk_sentence_split(default, paragraph, cache=cache)) == 2
+    assert len(custom_tokenizer.wrapped_nltk_sentence_split(trained, paragraph, cache=cache)) == 1
@@ -0,0 +1,21 @@
+import json
+
+import custom_tokenizer
+
+
+def test_jsonl_records_without_the_field_are_skipped(tmp_path, capsys):
+    source = tmp_path / "corpus.jsonl"
+    source.write_text("\n".join([json.dumps({"text": "Hello there."}),
+                                 json.dumps({"body": "no text here"}),
+                                 "{not json",
+                                 json.dumps({"text": "Bye."})]) + "\n", encoding="utf-8")
+    output = tmp_path / "tokens.jsonl"
+
+    assert custom_tokenizer.main([str(source), "-o", str(output), "-w", "1"]) == 0
+
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert [record["line"] for record in records] == [1, 4]
+    assert records[0]["tokens"] == ["Hello", "there", "."]
+    err = capsys.readouterr().err
+    assert "line 2: no 'text' field, skipped" in err
+    assert "line 3: not valid JSON" in err
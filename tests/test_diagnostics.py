@@ -0,0 +1,21 @@
+import custom_tokenizer
+
+
+def _collector(prefix, n, samples=10):
+    diagnostics = custom_tokenizer.Diagnostics(samples=samples)
+    for i in range(n):
+        diagnostics.record("event", "{}{}".format(prefix, i))
+    return diagnostics
+
+
+def test_merge_weights_examples_by_counts():
+    merged = _collector("small", 10).merge(_collector("large", 1000))
+    examples = merged.examples["event"]
+    assert merged.counts["event"] == 1010
+    assert len(examples) == 10
+    assert sum(example.startswith("large") for example in examples) >= 8
+
+
+def test_merge_keeps_every_example_that_fits():
+    merged = _collector("a", 3).merge(_collector("b", 4))
+    assert sorted(merged.examples["event"]) == ["a0", "a1", "a2", "b0", "b1", "b2", "b3"]
@@ -0,0 +1,39 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# importing the module must not pull in the heavy optional dependencies
+HEAVY_MODULES = ("nltk", "spacy", "numpy")
+# seconds and new modules an import of custom_tokenizer may take, far above what it needs today
+IMPORT_SECONDS_BUDGET = 1.0
+IMPORT_MODULES_BUDGET = 80
+
+_PROBE = """
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import custom_tokenizer
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "new": sorted(set(sys.modules) - before)}))
+"""
+
+
+def _import_custom_tokenizer():
+    output = subprocess.run([sys.executable, "-c", _PROBE], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_heavy_dependencies():
+    probe = _import_custom_tokenizer()
+    loaded = [name for name in probe["new"] if name.split(".")[0] in HEAVY_MODULES]
+    assert loaded == []
+
+
+def test_import_stays_within_budget():
+    probe = _import_custom_tokenizer()
+    assert probe["seconds"] < IMPORT_SECONDS_BUDGET
+    assert len(probe["new"]) < IMPORT_MODULES_BUDGET
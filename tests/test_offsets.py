@@ -0,0 +1,49 @@
+import time
+
+import pytest
+
+import custom_tokenizer
+
+
+def _spans(text):
+    result = custom_tokenizer.make_new_pretokenizer().tokenize(text, offsets=True)
+    return list(zip(result.tokens, result.get_spans()))
+
+
+def test_rewritten_words_keep_their_source_span():
+    assert ("Doctor", "Dr.") in _spans("Dr. Smith came")
+    assert ("Junior", "Jr.") in _spans("Jr. CMD. x")
+    assert ("Cmd", "CMD") in _spans("Jr. CMD. x")
+
+
+def test_contraction_maps_both_words_to_the_source_word():
+    spans = _spans("I won't go")
+    assert ("will", "won't") in spans
+    assert ("not", "won't") in spans
+
+
+@pytest.mark.parametrize("text, word, quotes", [
+    ('He said "Hello" ok', "Hello", ['"', '"']),
+    ("It's 'fine' ok", "fine", ["'", "'"]),
+    ("a \u201cna\u00efve\u201d b", "na\u00efve", ["\u201c", "\u201d"]),
+])
+def test_quoted_word_keeps_its_own_span(text, word, quotes):
+    spans = [span for _, span in _spans(text)]
+    start = spans.index(word)
+    assert [spans[start - 1], spans[start + 1]] == quotes
+
+
+def test_contraction_after_a_kept_word_spans_only_the_contraction():
+    assert ("will", "you'll") in _spans("10:30 Sr.you'll")
+    assert ("not", "can't") in _spans("Dr. Smith can't")
+
+
+def test_offsets_on_a_long_paragraph_are_linear():
+    sentence = "Dr. Smith won't pay $5,000 at 10:30 a.m. to the U.S.A. \"Fine,\" he said. "
+    text = sentence * 150
+    pretokenizer = custom_tokenizer.make_new_pretokenizer()
+    start = time.perf_counter()
+    result = pretokenizer.tokenize(text, offsets=True)
+    assert time.perf_counter() - start < 5
+    assert result.tokens == pretokenizer.tokenize(text).tokens
+    assert len(result.offsets) == len(result.tokens)
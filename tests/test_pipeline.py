@@ -0,0 +1,38 @@
+import custom_tokenizer
+
+
+def _http_rule(pretokenizer):
+    return next(rule for rule in pretokenizer.rules if isinstance(rule, custom_tokenizer.http_rule))
+
+
+def test_rule_configuration_is_not_shared_between_pretokenizers():
+    configured = custom_tokenizer.make_new_pretokenizer()
+    _http_rule(configured)._HTTP = "URL"
+    configured.compile()
+    default = custom_tokenizer.make_new_pretokenizer()
+
+    text = "see http://example.com now"
+    assert "URL" in configured.tokenize(text).tokens
+    assert "URL" not in default.tokenize(text).tokens
+    assert "http" in default.tokenize(text).tokens
+
+
+def test_changing_rules_after_tokenize_is_honoured():
+    pretokenizer = custom_tokenizer.make_new_pretokenizer()
+    text = "see http://example.com now"
+    assert "example" not in pretokenizer.tokenize(text).tokens
+
+    pretokenizer.rules.remove(_http_rule(pretokenizer))
+    assert "example" in pretokenizer.tokenize(text).tokens
+
+
+def test_normalize_characters_rule_equals_the_rules_it_fuses():
+    rules = [custom_tokenizer.normalize_dash_rule(), custom_tokenizer.pre_quote_rule(),
+             custom_tokenizer.remove_unicode_characters()]
+    fused = custom_tokenizer.normalize_characters_rule()
+    for text in ["a--b — c | d – e − f-g", "``hi'' “x” ‘y’ `z´", "Mr.’Smith .´A café €5 »",
+                 "‘—’", "-- '' `` .'A"]:
+        expected = text
+        for rule in rules:
+            _, expected = rule.use(custom_tokenizer.FeatureHolder(), expected)
+        assert fused.use(custom_tokenizer.FeatureHolder(), text)[1] == expected
@@ -0,0 +1,37 @@
+import pickle
+
+import pytest
+
+import custom_tokenizer
+
+TEXT = "The U.S.A. and NASA met"
+
+
+def test_get_fholder_supports_the_spacy_helpers():
+    pretokenizer = custom_tokenizer.make_new_pretokenizer()
+    result = pretokenizer.tokenize(TEXT)
+    tokens = list(result.tokens)
+
+    f_holder = pretokenizer.get_fholder()
+    f_holder.before_spacy()
+    assert "ACAPITAL" in f_holder.get_tokens()
+    f_holder.after_spacy()
+    assert f_holder.get_tokens() == tokens
+    assert result.tokens == tokens
+
+
+def test_spacy_helpers_leave_handed_out_results_alone():
+    pretokenizer = custom_tokenizer.make_new_pretokenizer()
+    result = pretokenizer.tokenize(TEXT)
+    tokens = list(result.tokens)
+
+    pretokenizer.f_holder.before_spacy()
+    assert result.tokens == tokens
+    assert pretokenizer.get_fholder().get_result().tokens != tokens
+
+
+def test_result_is_read_only_and_pickles():
+    result = custom_tokenizer.make_new_pretokenizer().tokenize(TEXT)
+    with pytest.raises(AttributeError):
+        result.tokens = []
+    assert pickle.loads(pickle.dumps(result)).tokens == result.tokens
@@ -0,0 +1,59 @@
+import pytest
+
+import custom_tokenizer
+
+
+@pytest.fixture(scope="module")
+def pretokenizer():
+    return custom_tokenizer.make_new_pretokenizer()
+
+
+@pytest.mark.parametrize("text, tokens", [
+    ("I said that'llIve ca.x it", ['I', 'said', '', 'that', 'will', 'I', 'havecirca', 'x', 'it']),
+    ("It'lltheses ca.5 x", ['', 'It', 'will', 'thesisescirca', '5', 'x']),
+])
+def test_special_words_formed_by_a_replacement_are_still_replaced(pretokenizer, text, tokens):
+    assert pretokenizer.tokenize(text).tokens == tokens
+
+
+@pytest.mark.parametrize("text", [
+    " I said that'llIve ca.x it ",
+    " It'lltheses ca.5 x ",
+    " We'd go, you'd see theses ca. 1900, Sr . Smith didnt ",
+    " c'mon y'all it'll be fine, Ive said so ",
+])
+def test_special_word_scan_equals_the_ordered_rewrite(text):
+    rule = custom_tokenizer.spacy_special_word_rules()
+    rule.compile()
+    assert rule.use(None, text)[1] == rule._rewrite_in_order(text)
+
+
+def test_time_rule_uses_its_own_time_token():
+    rule = custom_tokenizer.feature_time_rule()
+    rule.TIME = "#CLOCK#"
+    f_holder = custom_tokenizer.FeatureHolder()
+    assert rule.use_tokens(f_holder, ["at", "10:30pm"])[1] == "at #CLOCK# pm"
+    assert f_holder.feature_time_list == ["10:30"]
+    default = custom_tokenizer.feature_time_rule()
+    assert default.use_tokens(custom_tokenizer.FeatureHolder(), ["at", "10:30pm"])[1] == "at #TIME# pm"
+
+
+def _quote_rule(text):
+    result = custom_tokenizer.quote_rule().use_tokens(custom_tokenizer.FeatureHolder(), (" " + text + " ").split(" "))[1]
+    return result if isinstance(result, str) else " ".join(result)
+
+
+@pytest.mark.parametrize("text, expected", [
+    # a closing double quote that was never opened sends the whole string to simple_quote_rule
+    ('he is 6 ft tall", said "Bob" there', " he is 6 ft tall #LDQ# , said #LDQ# Bob #RDQ# there "),
+    # single quotes opened after the last closing one are apostrophes
+    ("the 'cat' and 'dog ran", " the #LSQ# cat #RSQ# and  ' dog ran "),
+    ("I 'm 'sure' you 'll 'see", " I #LSQ# m #LSQ# sure #RSQ# you  ' ll  ' see "),
+    # a number followed by a double quote is inches outside quotes and closes them inside
+    ('a 12" board', " a 12 inches board "),
+    ('"a 12" board', " #LDQ# a 12 #RDQ# board "),
+    ('The "big" 12" pipe', " The #LDQ# big #RDQ# 12 inches pipe "),
+    ("she said \"it's 'fine'\" and left", " she said #LDQ# it's #LSQ# fine #RSQ#  #RDQ# and left "),
+])
+def test_quote_rule_classifies_quote_shapes(text, expected):
+    assert _quote_rule(text) == expected
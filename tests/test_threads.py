@@ -0,0 +1,35 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import custom_tokenizer
+
+TEXTS = [
+    "Dr. Smith won't pay $5,000 at 10:30 a.m. to the U.S.A.",
+    'He said "Hello" and she said \'fine\' to NASA.',
+    "The 12\" pipe costs 3.5 dollars, CMD. Jr. said so...",
+    "see http://example.com now, I'm sure you'll like it",
+    "IBM and ACME met in May. They're 5 Docs.",
+]
+
+
+@pytest.fixture
+def switch_often():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_one_pretokenizer_from_several_threads(switch_often):
+    pretokenizer = custom_tokenizer.make_new_pretokenizer()
+    texts = [text + " " + str(i) for i in range(40) for text in TEXTS]
+
+    def tokenize(text):
+        result = pretokenizer.tokenize(text, offsets=True)
+        return result.tokens, result.features, result.offsets
+
+    expected = list(map(tokenize, texts))
+    with ThreadPoolExecutor(8) as executor:
+        assert list(executor.map(tokenize, texts)) == expected